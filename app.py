@@ -20,12 +20,16 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
 # Configure upload settings
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['UPLOAD_FOLDER'] = 'uploads'
+# Uploads live only until their review has been extracted; point this at a
+# tmpfs such as /dev/shm/uploads to keep them off disk
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+app.config['REPORT_FOLDER'] = 'reports'  # Generated report PDFs
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 300
 app.config['MAX_CONTENT_PATH'] = None  # Allow unlimited content path length
 
-# Ensure upload directory exists
+# Ensure upload and report directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['REPORT_FOLDER'], exist_ok=True)
 
 # configure the database, relative to the app instance folder
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///compliance_review.db")
@@ -41,6 +45,8 @@ with app.app_context():
     # Import models to ensure tables are created
     import models
     db.create_all()
+    # create_all never alters existing tables
+    models.upgrade_schema()
 
 # Import routes
 from routes import *
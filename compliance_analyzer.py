@@ -1,11 +1,28 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import asyncio
 import logging
-import locale
 import json
+import hashlib
+import re
+import queue
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import unicodedata
+from collections import OrderedDict
+
+try:
+    import orjson  # optional: C-level JSON encoder that emits UTF-8 bytes directly
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken  # optional: exact local token counts for request sizing
+except ImportError:
+    tiktoken = None
 
 # Strongly prefer UTF-8 everywhere at runtime (PYTHONIOENCODING only helps at process start)
 try:
@@ -47,22 +64,43 @@ def log_safe(prefix, text):
     except Exception:
         logging.info("%s%s", prefix, text.encode("unicode_escape").decode("ascii"))
 
-# Environment defaults
-os.environ['PYTHONIOENCODING'] = 'utf-8'
-os.environ['LANG'] = 'en_US.UTF-8'
-os.environ['LC_ALL'] = 'en_US.UTF-8'
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# the newest OpenAI model is "gpt-5" which was released August 7, 2025. do not change this unless explicitly requested by the user
+OPENAI_MODEL = "gpt-5"
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_FILES_URL = "https://api.openai.com/v1/files"
+OPENAI_BATCHES_URL = "https://api.openai.com/v1/batches"
+OPENAI_EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+# Optional cap on generated tokens; unset leaves the response length unlimited.
+# Reasoning models (gpt-5, o-series) count reasoning tokens against this cap.
+MAX_COMPLETION_TOKENS = int(os.environ.get("MAX_COMPLETION_TOKENS", "0")) or None
 
-# Set UTF-8 locale for requests
-try:
-    locale.setlocale(locale.LC_ALL, 'en_US.UTF-8')
-except Exception:
-    pass
 
-# For requests library
-import requests
-requests.models.Response.encoding = 'utf-8'
+def _completion_limit(model=OPENAI_MODEL):
+    """Return the payload entry capping output length for the given model."""
+    if MAX_COMPLETION_TOKENS is None:
+        return {}
+    # Reasoning models reject max_tokens; older chat models ignore max_completion_tokens
+    key = "max_completion_tokens" if model.startswith(("o", "gpt-5")) else "max_tokens"
+    return {key: MAX_COMPLETION_TOKENS}
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# One keep-alive session for the process, so repeated analyses reuse the TLS
+# connection to the API instead of handshaking on every call
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.headers.update({
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json"
+})
+# Transient 429/5xx responses are retried with exponential backoff. POST must be
+# allowed explicitly; the final response is returned rather than raised so the
+# status check in the caller still reports it.
+_HTTP_SESSION.mount("https://", HTTPAdapter(max_retries=Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)))
 
 if not OPENAI_API_KEY:
     logging.warning("OPENAI_API_KEY not found in environment variables")
@@ -214,6 +252,218 @@ Critical Observations:
 * Make statuses explicit with the bracketed color tags: [GREEN] [YELLOW] [RED] [GRAY] for every requirement line.
 """
 
+# Character substitutions applied before normalization; str.translate
+# performs all of them in a single C-level pass
+_TRANS = str.maketrans({
+    '\u2019': "'",  # right single quote
+    '\u2018': "'",  # left single quote
+    '\u201c': '"',  # left double quote
+    '\u201d': '"',  # right double quote
+    '\u2013': '-',  # en dash
+    '\u2014': '--', # em dash
+    '\u2026': '...',# ellipsis
+    '\u00b0': ' deg', # degree
+    '\u00bd': '1/2',
+    '\u00bc': '1/4',
+    '\u00be': '3/4',
+    '\u2022': '*',  # bullet
+    '\u00b7': '*',  # middle dot
+    '\u2032': "'",  # prime
+    '\u2033': '"',  # double prime
+    '\u00a0': ' ',  # non-breaking space
+    '\t': ' ',      # tab
+    '\r': '',       # carriage return
+})
+
+# Bytes outside printable ASCII (tabs and CRs are already translated away);
+# deleted in one bytes.translate pass after the ASCII encode
+_KEEP_BYTES = bytes(range(0x20, 0x7F)) + b'\n'
+_DELETE_BYTES = bytes(b for b in range(256) if b not in _KEEP_BYTES)
+_WS_RE = re.compile(r'\s+')
+
+def clean_text(text):
+    """Reduce text to single-spaced printable ASCII for the API request."""
+    if not isinstance(text, str):
+        return ""
+
+    text = text.translate(_TRANS)
+    # Machine-typed text is usually pure ASCII by now; NFKD would only copy it
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').translate(None, _DELETE_BYTES).decode('ascii')
+    return _WS_RE.sub(' ', text).strip()
+
+# Bump whenever SYSTEM_PROMPT or the report format changes so persisted
+# report cache entries from the old prompt stop matching
+SYSTEM_PROMPT_VERSION = 1
+
+# SYSTEM_PROMPT is a constant, so clean it once at import rather than per request
+_CLEAN_SYSTEM_PROMPT = clean_text(SYSTEM_PROMPT)
+assert _CLEAN_SYSTEM_PROMPT.isascii(), "SYSTEM_PROMPT must be ASCII-only"
+
+# Input budget per request; larger inputs are split into chunks up front
+# rather than failing at the API after a full upload
+MAX_REQUEST_TOKENS = int(os.environ.get("MAX_REQUEST_TOKENS", "120000"))
+
+def _load_token_encoding():
+    # tiktoken downloads the encoding on first use, so a host without network
+    # access falls back to estimates instead of failing at import
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"tiktoken encoding unavailable, estimating token counts: {str(e)}")
+        return None
+
+_TOKEN_ENCODING = _load_token_encoding()
+
+def count_tokens(text):
+    """Count tokens with tiktoken when installed, else estimate ~4 chars/token."""
+    if _TOKEN_ENCODING is not None:
+        return len(_TOKEN_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+_SYSTEM_PROMPT_TOKENS = count_tokens(_CLEAN_SYSTEM_PROMPT)
+
+# Always sent verbatim as messages[0]: a byte-identical prefix lets OpenAI's
+# automatic prompt caching reuse the ~1K+ token system prompt across calls
+_SYSTEM_MESSAGE = {"role": "system", "content": _CLEAN_SYSTEM_PROMPT}
+
+# In-process cache of completed analyses, keyed on a hash of the exact request
+# content, so re-running the same documents skips the OpenAI round-trip.
+# Bounded LRU; set RESPONSE_CACHE_SIZE=0 to disable.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "128"))
+_RESPONSE_CACHE = OrderedDict()
+
+def _update_digest(digest, *parts):
+    """Feed NUL-separated parts to digest one at a time, with no joined copy."""
+    for i, part in enumerate(parts):
+        if i:
+            digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest
+
+def _response_cache_key(model, system_prompt, user_message):
+    return _update_digest(hashlib.sha256(), model, system_prompt, user_message).hexdigest()
+
+# Hash state after the constant part of report_cache_key, copied per key
+_REPORT_KEY_DIGEST = _update_digest(hashlib.sha256(), str(SYSTEM_PROMPT_VERSION), OPENAI_MODEL, SYSTEM_PROMPT, "")
+
+def report_cache_key(project_spec_text, vendor_submittal_text):
+    """Key for the persistent report cache: identical documents, model and prompt."""
+    return _update_digest(_REPORT_KEY_DIGEST.copy(), project_spec_text, vendor_submittal_text).hexdigest()
+
+def _response_cache_get(key):
+    result = _RESPONSE_CACHE.get(key)
+    if result is not None:
+        _RESPONSE_CACHE.move_to_end(key)
+    return result
+
+def _response_cache_put(key, result):
+    if RESPONSE_CACHE_SIZE <= 0:
+        return
+    _RESPONSE_CACHE[key] = result
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+        _RESPONSE_CACHE.popitem(last=False)
+
+# Incremental re-review: when a submittal is re-run after small edits, only the
+# paragraphs after the unchanged prefix are sent together with the previous
+# report, and the model is asked to revise that report. Opt-in with
+# DELTA_REVIEW=1: the result depends on the earlier report, and sessions are
+# kept per process, so with several server processes a re-run only gets a
+# delta review when it lands on the process that did the previous one.
+DELTA_REVIEW = os.environ.get("DELTA_REVIEW", "0") == "1"
+DELTA_MIN_OVERLAP = 0.8
+_DELTA_SESSION_LIMIT = 256
+_DELTA_SESSIONS = OrderedDict()
+
+_DELTA_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+---
+## Incremental Re-Review Mode
+This mode overrides the Input Contract above.
+* Inputs: PROJECT_SPEC, PREVIOUS_REPORT (your earlier report for this SUBMITTAL), and SUBMITTAL_CHANGES.
+* SUBMITTAL_CHANGES states how many leading SUBMITTAL paragraphs are unchanged and gives the full replacement text for everything after them.
+* Findings in PREVIOUS_REPORT that cite unchanged paragraphs remain valid; re-evaluate everything that depended on the replaced content.
+* Output the complete revised report in the Strict Output Format, not a list of differences.
+"""
+_DELTA_SYSTEM_MESSAGE = {"role": "system", "content": clean_text(_DELTA_SYSTEM_PROMPT)}
+_DELTA_SYSTEM_PROMPT_TOKENS = count_tokens(_DELTA_SYSTEM_MESSAGE["content"])
+
+def _hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def split_submittal_blocks(text):
+    """Split raw submittal text into cleaned, non-empty paragraph blocks."""
+    if not isinstance(text, str):
+        return []
+    blocks = (clean_text(block) for block in text.split("\n\n"))
+    return [block for block in blocks if block]
+
+def _build_delta_message(session, spec_hash, project_spec_text, blocks, block_hashes):
+    """Return a delta user message, or None when the full submittal must be sent."""
+    if session is None or session["spec_hash"] != spec_hash:
+        return None
+
+    old_hashes = session["block_hashes"]
+    old_set, new_set = set(old_hashes), set(block_hashes)
+    shared = old_set & new_set
+    union = old_set | new_set
+    if not union or len(shared) / len(union) < DELTA_MIN_OVERLAP:
+        return None
+
+    prefix = 0
+    for old_hash, new_hash in zip(old_hashes, block_hashes):
+        if old_hash != new_hash:
+            break
+        prefix += 1
+
+    # Only an unchanged leading run is supported; edits scattered through the
+    # document fall back to a full review
+    if prefix == 0 or not shared <= set(block_hashes[:prefix]):
+        return None
+
+    tail = "\n\n".join(blocks[prefix:]) or "(none - the remaining paragraphs were removed)"
+    return clean_text(
+        f"PROJECT_SPEC:\n{project_spec_text}\n\n---\n\n"
+        f"PREVIOUS_REPORT:\n{session['report']}\n\n---\n\n"
+        f"SUBMITTAL_CHANGES (paragraphs 1-{prefix} unchanged; everything after paragraph {prefix} now reads):\n{tail}"
+    )
+
+def _remember_submittal(session_key, spec_hash, block_hashes, report, delta):
+    _DELTA_SESSIONS[session_key] = {
+        "spec_hash": spec_hash,
+        "block_hashes": block_hashes,
+        "report": report,
+        "delta": delta,
+    }
+    _DELTA_SESSIONS.move_to_end(session_key)
+    while len(_DELTA_SESSIONS) > _DELTA_SESSION_LIMIT:
+        _DELTA_SESSIONS.popitem(last=False)
+
+def _dumps_payload(payload):
+    """Serialize a request payload to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+def _iter_stream_content(response, usage=None):
+    """Yield content deltas from a streamed chat-completions (SSE) response."""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data: "):
+            continue
+        data = line[len(b"data: "):]
+        if data == b"[DONE]":
+            break
+        event = json.loads(data)
+        if usage is not None and event.get("usage"):
+            usage.update(event["usage"])
+        for choice in event.get("choices") or []:
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield content
+
 def chunk_large_document(text, max_chunk_size=50000):
     """Split large documents into smaller chunks while preserving context."""
     if len(text) <= max_chunk_size:
@@ -241,207 +491,341 @@ def chunk_large_document(text, max_chunk_size=50000):
     
     return chunks
 
-def analyze_compliance_chunk(project_spec_text, vendor_submittal_chunk, chunk_info=""):
-    """Analyze a single chunk of documents."""
-    # Enhanced clean_text function with aggressive cleaning
-    def clean_text(text):
-        if not isinstance(text, str):
-            return ""
-        
-        # First pass: Replace common Unicode characters
-        replacements = {
-            '\u2019': "'",  # right single quote
-            '\u2018': "'",  # left single quote
-            '\u201c': '"',  # left double quote
-            '\u201d': '"',  # right double quote
-            '\u2013': '-',  # en dash
-            '\u2014': '--', # em dash
-            '\u2026': '...',# ellipsis
-            '\u00b0': ' deg', # degree
-            '\u00bd': '1/2',
-            '\u00bc': '1/4',
-            '\u00be': '3/4',
-            '\u2022': '*',  # bullet
-            '\u00b7': '*',  # middle dot
-            '\u2032': "'",  # prime
-            '\u2033': '"',  # double prime
-            '\u00a0': ' ',  # non-breaking space
-            '\t': ' ',      # tab
-            '\r': '',       # carriage return
-        }
-        for old, new in replacements.items():
-            text = text.replace(old, new)
-        
-        # Second pass: Normalize Unicode decomposition
-        try:
-            text = unicodedata.normalize('NFKD', text)
-        except Exception:
-            pass
-        
-        # Third pass: Convert to ASCII bytes and back to remove all non-ASCII
-        try:
-            text = text.encode('ascii', errors='ignore').decode('ascii')
-        except Exception:
-            # Fallback: manually strip non-ASCII characters
-            text = ''.join(ch for ch in text if ord(ch) < 128)
-        
-        # Final aggressive cleanup - remove any remaining non-printable chars
-        import string
-        printable = set(string.printable)
-        text = ''.join(filter(lambda x: x in printable, text))
-        
-        # Remove any null bytes or control characters
-        text = text.replace('\x00', '')
-        text = ''.join(ch for ch in text if ord(ch) >= 32 or ch in '\n\r\t')
-        
-        # Normalize whitespace
-        text = ' '.join(text.split())
-        return text
-    
-    clean_system_prompt = clean_text(SYSTEM_PROMPT)
-    
-    user_message = f"""PROJECT_SPEC:
-{project_spec_text}
-
----
-
-SUBMITTAL{chunk_info}:
-{vendor_submittal_chunk}"""
+def _log_prompt_cache(usage):
+    """
+    Log how much of the prompt was served from OpenAI's automatic prompt cache.
+    A steady 0 means the system message prefix is not byte-identical across calls.
+    """
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    if prompt_tokens:
+        logging.info("Prompt cache: %d of %d prompt tokens cached (%.0f%%)",
+                     cached_tokens, prompt_tokens, 100.0 * cached_tokens / prompt_tokens)
 
-    clean_user_message = clean_text(user_message)
-    clean_user_message = clean_user_message.encode('utf-8', errors='ignore').decode('utf-8')
-    
+def _post_completion(user_message, timeout=300, system_message=_SYSTEM_MESSAGE, response_format=None):
+    """POST one non-streaming chat completion and return the message content."""
     payload = {
-        "model": "gpt-5",
+        "model": OPENAI_MODEL,
         "messages": [
-            {"role": "system", "content": clean_system_prompt},
-            {"role": "user", "content": clean_user_message}
-        ]
+            system_message,
+            {"role": "user", "content": user_message}
+        ],
+        **_completion_limit(),
     }
-    
-    session = requests.Session()
-    session.headers.update({
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json; charset=utf-8"
-    })
-    
+    if response_format is not None:
+        payload["response_format"] = response_format
+    response = _HTTP_SESSION.post(OPENAI_CHAT_URL, data=_dumps_payload(payload), timeout=timeout)
+
+    if response.status_code != 200:
+        raise Exception(f"OpenAI API error: {response.status_code}")
+
+    result_json = response.json()
+    if result_json.get('usage'):
+        _log_prompt_cache(result_json['usage'])
+
+    if 'choices' in result_json and result_json['choices']:
+        return result_json['choices'][0]['message']['content']
+    raise Exception("No response content from OpenAI API")
+
+def analyze_compliance_chunk(project_spec_text, vendor_submittal_chunk, chunk_info=""):
+    """Analyze a single chunk of documents."""
+    # Both parts arrive cleaned, so they are joined as-is without a second pass
+    user_message = ''.join((
+        "PROJECT_SPEC:\n", project_spec_text,
+        "\n\n---\n\nSUBMITTAL", chunk_info, ":\n", vendor_submittal_chunk,
+    ))
+
     try:
-        response = session.post(
-            "https://api.openai.com/v1/chat/completions",
-            json=payload,
-            timeout=300
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"OpenAI API error: {response.status_code}")
-        
-        result_json = response.json()
-        
-        if 'choices' in result_json and result_json['choices']:
-            content = result_json['choices'][0]['message']['content']
-            return clean_text(content)
-        else:
-            raise Exception("No response content from OpenAI API")
+        return clean_text(_post_completion(user_message))
             
     except requests.exceptions.Timeout:
         raise Exception("OpenAI API request timed out for this chunk")
     except Exception as e:
         raise Exception(f"Failed to analyze chunk: {str(e)}")
 
-def analyze_compliance(project_spec_text, vendor_submittal_text):
+# Per-model fan-out: when a submittal covers several models, each model is
+# analyzed in its own concurrent request and the reports are merged. Model
+# detection is heuristic, so this is opt-in.
+PER_MODEL_ANALYSIS = os.environ.get("PER_MODEL_ANALYSIS", "0") == "1"
+# Upper bound on per-model requests in flight, to stay under the API rate limit
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "10"))
+# Attempts per request when it times out or the connection drops;
+# 429/5xx responses are already retried by the session adapter
+MODEL_REQUEST_ATTEMPTS = 3
+
+_MODEL_HEADING_RE = re.compile(
+    r'^[ \t]*Model(?:[ \t]*[:#]|[ \t]+(?:No\.?|Number)[ \t]*[:#]?)[ \t]*([A-Za-z0-9][\w./-]*)',
+    re.IGNORECASE | re.MULTILINE,
+)
+_OVERALL_STATUS_RE = re.compile(r'Overall compliance status:[^A-Za-z\n]*([A-Za-z -]+)', re.IGNORECASE)
+# A model's own summary lines, relabelled in a merged report so that report's
+# combined summary is the only one its summary parsing reads
+_MODEL_COUNT_LINE_RE = re.compile(
+    r'^[^\n]*Number of (?:models reviewed|compliant models identified)[^\n]*\n?', re.MULTILINE
+)
+
+def split_submittal_by_model(text):
+    """
+    Split raw submittal text into {model: section_text} on "Model: X" headings.
+    Text before the first heading is shared and prefixed to every section;
+    repeated headings for the same model are merged.
+    """
+    if not isinstance(text, str):
+        return {}
+
+    matches = list(_MODEL_HEADING_RE.finditer(text))
+    if not matches:
+        return {}
+
+    preamble = text[:matches[0].start()]
+    sections = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        end = next_match.start() if next_match else len(text)
+        sections.setdefault(match.group(1), []).append(text[match.start():end])
+
+    return {model: preamble + "".join(parts) for model, parts in sections.items()}
+
+def _report_status(report):
+    """Read the overall status line from a report, defaulting to Insufficient Data."""
+    match = _OVERALL_STATUS_RE.search(report)
+    status = match.group(1).strip().lower() if match else ""
+    if "partially" in status:
+        return "Partially Compliant"
+    if "non" in status:
+        return "Non-Compliant"
+    if "compliant" in status:
+        return "Compliant"
+    return "Insufficient Data"
+
+def merge_model_reports(model_reports):
+    """Combine per-model reports into one report with an overall summary."""
+    statuses = []
+    sections = []
+    for model, report in model_reports:
+        if isinstance(report, Exception):
+            statuses.append("Insufficient Data")
+            sections.append(f"\n## Model: {model}\nError analyzing model {model}: {report}\n")
+        else:
+            statuses.append(_report_status(report))
+            report = _MODEL_COUNT_LINE_RE.sub("", report).replace(
+                "Overall compliance status", "Model compliance status"
+            )
+            sections.append(f"\n## Model: {model}\n{report}\n")
+
+    # Same rules the system prompt gives for the overall status
+    if "Compliant" in statuses:
+        overall = "Compliant"
+    elif "Partially Compliant" in statuses:
+        overall = "Partially Compliant"
+    elif "Non-Compliant" in statuses:
+        overall = "Non-Compliant"
+    else:
+        overall = "Insufficient Data"
+
+    combined_report = "# Executive Summary\n"
+    combined_report += f"* Overall compliance status: {overall}\n"
+    combined_report += f"* Number of models reviewed: {len(model_reports)}\n"
+    combined_report += f"* Number of compliant models identified: {statuses.count('Compliant')}\n"
+    combined_report += "* Each model was analyzed in a separate request\n\n"
+    combined_report += "# Detailed Analysis by Model Number\n"
+    combined_report += "".join(sections)
+    return combined_report
+
+async def _post_completion_async(semaphore, label, user_message, **kwargs):
+    """
+    Run _post_completion on a worker thread once the semaphore admits it,
+    retrying timeouts and dropped connections with exponential backoff.
+    """
+    async with semaphore:
+        for attempt in range(MODEL_REQUEST_ATTEMPTS):
+            try:
+                return await asyncio.to_thread(_post_completion, user_message, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if attempt == MODEL_REQUEST_ATTEMPTS - 1:
+                    raise
+                delay = 0.5 * 2 ** attempt
+                logging.warning("%s request failed (%s); retrying in %.1fs", label, e, delay)
+                await asyncio.sleep(delay)
+
+async def analyze_compliance_async(project_spec_text, submittals):
+    """
+    Analyze each (model, submittal_text) pair concurrently against the project
+    specification and merge the per-model reports. At most
+    MAX_CONCURRENT_REQUESTS run at once. Failed models are reported inline
+    rather than failing the whole analysis.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def one_model(model, submittal_text):
+        user_message = clean_text(
+            f"PROJECT_SPEC:\n{project_spec_text}\n\n---\n\nSUBMITTAL (Model {model} only):\n{submittal_text}"
+        )
+        return await _post_completion_async(semaphore, f"Model {model}", user_message)
+
+    reports = await asyncio.gather(
+        *(one_model(model, text) for model, text in submittals),
+        return_exceptions=True,
+    )
+    return merge_model_reports([(model, report) for (model, _), report in zip(submittals, reports)])
+
+# Map-reduce for submittals too large for one request: each page-aligned
+# chunk is condensed to a JSON extract of its model specifications, and one
+# final request writes the report from the spec plus all the extracts
+MAP_CHUNK_TOKENS = int(os.environ.get("MAP_CHUNK_TOKENS", "30000"))
+
+# Page banners as they look after clean_text, in both the compressed
+# (--- PAGE N ---) and the raw (=====PAGE N=====) extraction formats
+_PAGE_BOUNDARY_RE = re.compile(r'(?=--- PAGE \d+ ---|={50} PAGE \d+ ={50})')
+
+_EXTRACT_SYSTEM_PROMPT = """You extract product data from one part of a vendor submittal for an engineering compliance review.
+
+Return a single JSON object of the form:
+{"models": [{"model": "...", "manufacturer": "...", "specifications": {"<parameter>": "<value with units>"}, "certifications": ["..."], "notes": ["..."]}]}
+
+- Include every model number, rating, dimension, material, performance value, listing and referenced standard that appears in this part, copied exactly with units.
+- Do not evaluate compliance, infer missing values or add commentary.
+- If the part contains no product data, return {"models": []}."""
+
+_EXTRACT_SYSTEM_MESSAGE = {"role": "system", "content": clean_text(_EXTRACT_SYSTEM_PROMPT)}
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+def split_on_pages(text, max_tokens=MAP_CHUNK_TOKENS):
+    """
+    Pack whole pages into chunks of at most max_tokens tokens. A single page
+    over the limit is split on words instead.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for page in _PAGE_BOUNDARY_RE.split(text):
+        if not page:
+            continue
+        tokens = count_tokens(page)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(''.join(current))
+            current = []
+            current_tokens = 0
+        if tokens > max_tokens:
+            chunks.extend(chunk_large_document(page, max_chunk_size=int(max_tokens * len(page) / tokens)))
+            continue
+        current.append(page)
+        current_tokens += tokens
+
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+async def _extract_submittal_parts(chunks):
+    """Extract model specifications from each submittal chunk concurrently."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def one_part(number, chunk):
+        user_message = f"SUBMITTAL (Part {number} of {len(chunks)}):\n{chunk}"
+        return await _post_completion_async(
+            semaphore, f"Part {number}", user_message,
+            system_message=_EXTRACT_SYSTEM_MESSAGE,
+            response_format=_JSON_RESPONSE_FORMAT,
+        )
+
+    return await asyncio.gather(
+        *(one_part(number, chunk) for number, chunk in enumerate(chunks, 1)),
+        return_exceptions=True,
+    )
+
+def analyze_compliance_map_reduce(project_spec_text, vendor_submittal_text):
+    """
+    Review a submittal that is too large for one request. Both texts must
+    already be cleaned. Parts that fail extraction are passed to the final
+    request as errors so the report marks their data as missing.
+    """
+    chunks = split_on_pages(vendor_submittal_text)
+    logging.info("Extracting model specifications from %d submittal parts", len(chunks))
+    extracts = asyncio.run(_extract_submittal_parts(chunks))
+
+    parts = []
+    for number, extract in enumerate(extracts, 1):
+        if isinstance(extract, Exception):
+            logging.error("Error extracting submittal part %d: %s", number, extract)
+            extract = json.dumps({"error": f"Part {number} could not be extracted: {extract}"})
+        parts.append(f"\n[Part {number} of {len(extracts)}]\n{clean_text(extract)}")
+
+    user_message = ''.join((
+        "PROJECT_SPEC:\n", project_spec_text,
+        "\n\n---\n\nSUBMITTAL (model specifications extracted from each part, as JSON):", *parts,
+    ))
+    logging.info("Writing report from %d extracts (%d tokens)", len(parts), count_tokens(user_message))
+    return _post_completion(user_message)
+
+def analyze_compliance(project_spec_text, vendor_submittal_text, session_key=None, on_chunk=None, details=None):
     """
     Analyze compliance between project specification and vendor submittal using OpenAI.
     Handles large documents by chunking them into smaller pieces.
     All strings are sanitized to ASCII for safety.
+    With DELTA_REVIEW on and a session_key, a re-run of a lightly edited
+    submittal under the same key sends only the changed paragraphs plus the
+    previous report; details, if given, then gets "delta": True, since such a
+    report must not be cached as the review of the full documents.
+    The response is streamed; on_chunk, if given, is called with each piece of
+    text as it arrives. The full report is returned either way.
     """
     if not OPENAI_API_KEY:
         raise ValueError(
             "OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."
         )
 
-    # Enhanced clean_text function with aggressive cleaning
-    def clean_text(text):
-        if not isinstance(text, str):
-            return ""
-        
-        # First pass: Replace common Unicode characters
-        replacements = {
-            '\u2019': "'",  # right single quote
-            '\u2018': "'",  # left single quote
-            '\u201c': '"',  # left double quote
-            '\u201d': '"',  # right double quote
-            '\u2013': '-',  # en dash
-            '\u2014': '--', # em dash
-            '\u2026': '...',# ellipsis
-            '\u00b0': ' deg', # degree
-            '\u00bd': '1/2',
-            '\u00bc': '1/4',
-            '\u00be': '3/4',
-            '\u2022': '*',  # bullet
-            '\u00b7': '*',  # middle dot
-            '\u2032': "'",  # prime
-            '\u2033': '"',  # double prime
-            '\u00a0': ' ',  # non-breaking space
-            '\t': ' ',      # tab
-            '\r': '',       # carriage return
-        }
-        for old, new in replacements.items():
-            text = text.replace(old, new)
-        
-        # Second pass: Normalize Unicode decomposition
-        try:
-            text = unicodedata.normalize('NFKD', text)
-        except Exception:
-            pass
-        
-        # Third pass: Convert to ASCII bytes and back to remove all non-ASCII
-        try:
-            text = text.encode('ascii', errors='ignore').decode('ascii')
-        except Exception:
-            # Fallback: manually strip non-ASCII characters
-            text = ''.join(ch for ch in text if ord(ch) < 128)
-        
-        # Final aggressive cleanup - remove any remaining non-printable chars
-        import string
-        printable = set(string.printable)
-        text = ''.join(filter(lambda x: x in printable, text))
-        
-        # Remove any null bytes or control characters
-        text = text.replace('\x00', '')
-        text = ''.join(ch for ch in text if ord(ch) >= 32 or ch in '\n\r\t')
-        
-        # Normalize whitespace
-        text = ' '.join(text.split())
-        return text
+    # Model sections have to be found in the raw text, before cleaning
+    # collapses the line breaks the headings are matched on
+    if PER_MODEL_ANALYSIS:
+        model_sections = split_submittal_by_model(vendor_submittal_text)
+        if len(model_sections) > 1:
+            logging.info("Analyzing %d models concurrently: %s", len(model_sections), list(model_sections))
+            return asyncio.run(analyze_compliance_async(clean_text(project_spec_text), list(model_sections.items())))
+
+    # Paragraph blocks have to come from the raw text, before cleaning
+    # collapses the paragraph breaks
+    submittal_blocks = split_submittal_blocks(vendor_submittal_text) if DELTA_REVIEW and session_key else None
 
     project_spec_text = clean_text(project_spec_text)
     vendor_submittal_text = clean_text(vendor_submittal_text)
 
     # Check if documents are too large and need chunking
-    total_size = len(project_spec_text) + len(vendor_submittal_text)
-    max_single_request_size = 150000  # 150K characters limit for single request
+    spec_tokens = count_tokens(project_spec_text)
+    submittal_tokens = count_tokens(vendor_submittal_text)
+    input_budget = MAX_REQUEST_TOKENS - _SYSTEM_PROMPT_TOKENS
     
-    logging.info(f"Document sizes - Project: {len(project_spec_text)}, Submittal: {len(vendor_submittal_text)}, Total: {total_size}")
+    logging.info("Document sizes - Project: %d chars/%d tokens, Submittal: %d chars/%d tokens",
+                 len(project_spec_text), spec_tokens, len(vendor_submittal_text), submittal_tokens)
     
-    if total_size > max_single_request_size:
-        logging.info(f"Large document detected ({total_size} chars). Using chunked analysis approach.")
+    if spec_tokens + submittal_tokens > input_budget:
+        logging.info("Large document detected (%d tokens). Using chunked analysis approach.", spec_tokens + submittal_tokens)
         
-        # Chunk the larger document (usually the submittal)
-        if len(vendor_submittal_text) > len(project_spec_text):
-            chunks = chunk_large_document(vendor_submittal_text, max_chunk_size=50000)
-            logging.info(f"Split submittal into {len(chunks)} chunks")
+        # Chunk the larger document (usually the submittal) so each chunk plus
+        # the other document fits the budget
+        chunk_submittal = submittal_tokens > spec_tokens
+        # An oversized submittal is condensed part by part, as long as the
+        # spec leaves room for the extracts in the final request
+        if chunk_submittal and spec_tokens <= input_budget // 2:
+            return analyze_compliance_map_reduce(project_spec_text, vendor_submittal_text)
+        if chunk_submittal:
+            chunk_source, chunk_tokens, other_tokens = vendor_submittal_text, submittal_tokens, spec_tokens
         else:
-            chunks = chunk_large_document(project_spec_text, max_chunk_size=50000)
-            logging.info(f"Split project spec into {len(chunks)} chunks")
+            chunk_source, chunk_tokens, other_tokens = project_spec_text, spec_tokens, submittal_tokens
+        chunk_budget = max(input_budget - other_tokens, input_budget // 4)
+        max_chunk_size = int(chunk_budget * len(chunk_source) / chunk_tokens)
+        chunks = chunk_large_document(chunk_source, max_chunk_size=max_chunk_size)
+        if chunk_submittal:
+            logging.info("Split submittal into %d chunks", len(chunks))
+        else:
+            logging.info("Split project spec into %d chunks", len(chunks))
         
         # Process each chunk
         chunk_results = []
         for i, chunk in enumerate(chunks):
             try:
-                logging.info(f"Processing chunk {i+1}/{len(chunks)}...")
+                logging.info("Processing chunk %d/%d...", i + 1, len(chunks))
                 chunk_info = f" (Part {i+1} of {len(chunks)})"
                 
-                if len(vendor_submittal_text) > len(project_spec_text):
+                if chunk_submittal:
                     # Submittal was chunked
                     result = analyze_compliance_chunk(project_spec_text, chunk, chunk_info)
                 else:
@@ -449,7 +833,7 @@ def analyze_compliance(project_spec_text, vendor_submittal_text):
                     result = analyze_compliance_chunk(chunk, vendor_submittal_text, chunk_info)
                 
                 chunk_results.append(result)
-                logging.info(f"Chunk {i+1} analysis completed")
+                logging.info("Chunk %d analysis completed", i + 1)
                 
             except Exception as e:
                 logging.error(f"Error processing chunk {i+1}: {str(e)}")
@@ -462,229 +846,521 @@ def analyze_compliance(project_spec_text, vendor_submittal_text):
         combined_report += "* Overall compliance status: Partially Compliant (based on chunked analysis)\n\n"
         
         combined_report += "# Detailed Analysis by Chunk\n"
-        for i, result in enumerate(chunk_results):
-            combined_report += f"\n## Chunk {i+1} Analysis:\n"
-            combined_report += result + "\n"
+        combined_report += "".join(
+            f"\n## Chunk {i+1} Analysis:\n{result}\n" for i, result in enumerate(chunk_results)
+        )
         
         return combined_report
     
-    # Single document processing (original logic)
-    user_message = f"""PROJECT_SPEC:
-{project_spec_text}
-
----
-
-SUBMITTAL:
-{vendor_submittal_text}"""
+    # Single document processing (original logic). Both parts were cleaned
+    # above, so they are joined as-is without a second clean_text pass.
+    user_message = ''.join((
+        "PROJECT_SPEC:\n", project_spec_text,
+        "\n\n---\n\nSUBMITTAL:\n", vendor_submittal_text,
+    ))
 
     try:
         logging.info("Sending compliance analysis request to OpenAI...")
 
-        # Clean the system prompt and the user message to ensure ASCII
-        clean_system_prompt = clean_text(SYSTEM_PROMPT)
-        clean_user_message = clean_text(user_message)
+        # The system prompt is pre-cleaned at import
+        clean_system_prompt = _CLEAN_SYSTEM_PROMPT
         
-        # Ensure the text is properly encoded as UTF-8 bytes then decoded
-        # This helps ensure clean UTF-8 strings
-        clean_system_prompt = clean_system_prompt.encode('utf-8', errors='ignore').decode('utf-8')
-        clean_user_message = clean_user_message.encode('utf-8', errors='ignore').decode('utf-8')
+        # Identical requests return the previously generated report
+        cache_key = _response_cache_key(OPENAI_MODEL, clean_system_prompt, user_message)
+        cached_result = _response_cache_get(cache_key)
+        if cached_result is not None:
+            logging.info("Returning cached compliance analysis")
+            return cached_result
         
-        # STEP 1 - Debug initial cleaning
-        log_safe("STEP 1 - Initial cleaning complete. System prompt length: ", str(len(clean_system_prompt)))
-        log_safe("STEP 1 - User message length: ", str(len(clean_user_message)))
+        system_message = _SYSTEM_MESSAGE
+        request_message = user_message
+        delta = False
+        if submittal_blocks is not None:
+            spec_hash = _hash_text(project_spec_text)
+            block_hashes = [_hash_text(block) for block in submittal_blocks]
+            session = _DELTA_SESSIONS.get(session_key)
+            if session is not None and session["spec_hash"] == spec_hash and session["block_hashes"] == block_hashes:
+                logging.info("Submittal unchanged since previous review; returning previous report")
+                if details is not None:
+                    details["delta"] = session["delta"]
+                return session["report"]
+            delta_message = _build_delta_message(session, spec_hash, project_spec_text, submittal_blocks, block_hashes)
+            # The previous report can make the delta request larger than the
+            # full one, which is known to fit
+            if delta_message is not None and count_tokens(delta_message) > MAX_REQUEST_TOKENS - _DELTA_SYSTEM_PROMPT_TOKENS:
+                logging.info("Delta request over the token budget; sending the full review instead")
+                delta_message = None
+            if delta_message is not None:
+                logging.info("Submittal largely unchanged; sending delta request (%d chars)", len(delta_message))
+                system_message = _DELTA_SYSTEM_MESSAGE
+                request_message = delta_message
+                delta = True
         
-        # Debug: Check for Unicode in original SYSTEM_PROMPT
-        logging.info("DEBUG: Checking raw SYSTEM_PROMPT for Unicode...")
-        for i, ch in enumerate(SYSTEM_PROMPT[:50]):
-            if ord(ch) > 127:
-                logging.error(f"FOUND UNICODE IN RAW SYSTEM_PROMPT at position {i}: {ch!r} (U+{ord(ch):04X})")
-                break
-        
-        # Debug: Check for Unicode in cleaned system prompt
-        logging.info("DEBUG: Checking cleaned system prompt for Unicode...")
-        for i, ch in enumerate(clean_system_prompt[:50]):
-            if ord(ch) > 127:
-                logging.error(f"FOUND UNICODE IN CLEANED SYSTEM_PROMPT at position {i}: {ch!r} (U+{ord(ch):04X})")
-                break
-
-        log_safe("STEP 2 - UTF-8 encoding/decoding complete. System prompt length: ", str(len(clean_system_prompt)))
-        log_safe("STEP 2 - User message length: ", str(len(clean_user_message)))
+        # STEP 1 - Debug initial cleaning
+        logging.debug("STEP 1 - Initial cleaning complete. System prompt length: %d", len(clean_system_prompt))
+        logging.debug("STEP 1 - User message length: %d", len(user_message))
 
         # STEP 3 - Prepare the payload
-        logging.info("STEP 3 - Preparing JSON payload...")
+        logging.debug("STEP 3 - Preparing JSON payload...")
         payload = {
-            "model": "gpt-5",  # the newest OpenAI model is "gpt-5" which was released August 7, 2025. do not change this unless explicitly requested by the user
+            "model": OPENAI_MODEL,
             "messages": [
-                {"role": "system", "content": clean_system_prompt},
-                {"role": "user", "content": clean_user_message}
-            ]
-            # Removed max_completion_tokens to allow unlimited response length
+                system_message,
+                {"role": "user", "content": request_message}
+            ],
+            # Stream tokens so the first output arrives after ~1 s instead of
+            # after the whole report has been generated
+            "stream": True,
+            "stream_options": {"include_usage": True},
+            **_completion_limit(),
             # Removed temperature setting - GPT-5 uses default value of 1
         }
         
-        # Comprehensive debugging - check every string in payload
-        logging.info("DEBUG: Checking all payload strings for Unicode...")
-        for key, value in payload.items():
-            if isinstance(value, str):
-                for i, ch in enumerate(value):
-                    if ord(ch) > 127:
-                        logging.error(f"FOUND UNICODE IN PAYLOAD[{key}] at position {i}: {ch!r} (U+{ord(ch):04X})")
-                        break
-            elif isinstance(value, list):
-                for idx, item in enumerate(value):
-                    if isinstance(item, dict):
-                        for sub_key, sub_value in item.items():
-                            if isinstance(sub_value, str):
-                                for i, ch in enumerate(sub_value):
-                                    if ord(ch) > 127:
-                                        logging.error(f"FOUND UNICODE IN PAYLOAD[{key}][{idx}][{sub_key}] at position {i}: {ch!r} (U+{ord(ch):04X})")
-                                        break
-
-        # Assertion to verify ASCII-only content
-        def assert_ascii(s, label=""):
-            if isinstance(s, str):
-                bad = [(i, ch, ord(ch)) for i, ch in enumerate(s) if ord(ch) >= 128]
-                if bad:
-                    raise ValueError(f"Non-ASCII in {label}: first few -> {bad[:5]}")
-
-        assert_ascii(clean_system_prompt, "system")
-        assert_ascii(clean_user_message, "user")
-
-        # STEP 4 - Final check for non-ASCII characters
-        logging.info("DEBUG: Final check for non-ASCII characters...")
-        try:
-            for i, ch in enumerate(clean_user_message):
-                if ord(ch) > 127:
-                    logging.error(f"Found non-ASCII in clean_user_message at position {i}: {ch!r} (U+{ord(ch):04X})")
-                    # Log context around the problematic character
-                    start = max(0, i-20)
-                    end = min(len(clean_user_message), i+20)
-                    logging.error(f"Context: ...{clean_user_message[start:end]!r}...")
-                    break
-            
-            for i, ch in enumerate(clean_system_prompt):
-                if ord(ch) > 127:
-                    logging.error(f"Found non-ASCII in clean_system_prompt at position {i}: {ch!r} (U+{ord(ch):04X})")
-                    # Log context around the problematic character
-                    start = max(0, i-20)
-                    end = min(len(clean_system_prompt), i+20)
-                    logging.error(f"Context: ...{clean_system_prompt[start:end]!r}...")
-                    break
-        except Exception as e:
-            logging.error(f"Debug check failed: {e}")
-            
-        # STEP 5 - Use requests directly for complete encoding control
-        logging.info("STEP 5 - Creating HTTP session...")
-        session = requests.Session()
-        session.headers.update({
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json; charset=utf-8"  # Explicitly set UTF-8
-        })
-
-        # STEP 6 - Manually encode the JSON payload to ensure UTF-8
-        logging.info("STEP 6 - Encoding JSON payload...")
-        try:
-            json_payload = json.dumps(payload, ensure_ascii=True)  # Force ASCII in JSON
-            logging.info(f"STEP 6 - JSON payload created successfully. Length: {len(json_payload)}")
-            logging.info(f"STEP 6 - First 200 chars of JSON: {json_payload[:200]}")
-        except Exception as json_error:
-            logging.error(f"STEP 6 - JSON encoding failed: {json_error}")
-            # Try to identify which field caused the issue
-            for key, value in payload.items():
-                try:
-                    test_json = json.dumps({key: value}, ensure_ascii=True)
-                    logging.info(f"STEP 6 - Field '{key}' encoded successfully")
-                except Exception as field_error:
-                    logging.error(f"STEP 6 - Field '{key}' failed to encode: {field_error}")
-            raise
+        # Cleaning guarantees ASCII; re-verify only when debugging
+        if __debug__ and os.environ.get("DOCREVIEW_DEBUG") and not request_message.isascii():
+            raise ValueError("Non-ASCII characters in user message")
+
+        # STEP 6 - Serialize once to bytes; the content is already ASCII
+        logging.debug("STEP 6 - Encoding JSON payload...")
+        json_payload = _dumps_payload(payload)
+        logging.debug("STEP 6 - JSON payload created successfully. Length: %d head=%.200r", len(json_payload), json_payload)
+        # The serialized bytes are all that is needed from here on; drop the
+        # text copies so they are not held alongside it during the request
+        del payload, user_message, request_message, project_spec_text, vendor_submittal_text, submittal_blocks
         
-        logging.info("STEP 7 - Making HTTP request...")
+        logging.debug("STEP 7 - Making HTTP request...")
         try:
             # Let requests handle the encoding - don't double-encode
-            response = session.post(
-                "https://api.openai.com/v1/chat/completions",
-                data=json_payload,  # Pass the JSON string directly, let requests encode it
-                headers={"Content-Type": "application/json; charset=utf-8"},
-                timeout=90  # 90 seconds - prevent worker timeout
+            response = _HTTP_SESSION.post(
+                OPENAI_CHAT_URL,
+                data=json_payload,  # Already-encoded UTF-8 bytes
+                timeout=90,  # 90 seconds between bytes - prevent worker timeout
+                stream=True
             )
-            logging.info(f"STEP 7 - HTTP request completed. Status: {response.status_code}")
+            logging.debug("STEP 7 - HTTP request completed. Status: %s", response.status_code)
         except requests.exceptions.Timeout as timeout_error:
             logging.error(f"STEP 7 - Request timeout after 90 seconds: {timeout_error}")
             raise Exception("OpenAI API request timed out. Please try again with smaller documents or try again later.")
         except requests.exceptions.ConnectionError as conn_error:
             logging.error(f"STEP 7 - Connection error: {conn_error}")
             raise Exception("Unable to connect to OpenAI API. Please check your internet connection and try again.")
-        except Exception as http_error:
+        except requests.exceptions.RequestException as http_error:
             logging.error(f"STEP 7 - HTTP request failed: {http_error}")
-            # Try alternative approach with json parameter
-            logging.info("STEP 7 - Trying alternative approach with json parameter...")
-            try:
-                response = session.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    json=payload,  # Let requests handle JSON encoding completely
-                    timeout=90  # 90 seconds - prevent worker timeout
-                )
-                logging.info(f"STEP 7 - Alternative approach succeeded. Status: {response.status_code}")
-            except requests.exceptions.Timeout as alt_timeout:
-                logging.error(f"STEP 7 - Alternative approach timeout: {alt_timeout}")
-                raise Exception("OpenAI API request timed out. Please try again with smaller documents or try again later.")
-            except Exception as alt_error:
-                logging.error(f"STEP 7 - Alternative approach also failed: {alt_error}")
-                raise Exception(f"Failed to connect to OpenAI API: {str(alt_error)}")
+            raise Exception(f"Failed to connect to OpenAI API: {str(http_error)}")
 
         if response.status_code != 200:
             # Avoid logging raw response.text if your sink is not UTF-8
+            response.encoding = 'utf-8'
             log_safe("OpenAI API error body: ", response.text)
             raise Exception(f"OpenAI API error: {response.status_code}")
 
-        result_json = response.json()
+        # Accumulate the streamed completion, forwarding each piece as it arrives
+        usage = {}
+        parts = []
+        for chunk in _iter_stream_content(response, usage):
+            parts.append(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+        result = "".join(parts)
         
-        # Debug: Show the complete API response structure
-        logging.info("=" * 80)
-        logging.info("FULL OPENAI API RESPONSE STRUCTURE:")
-        logging.info("=" * 80)
-        logging.info(f"Response keys: {list(result_json.keys())}")
-        if 'choices' in result_json:
-            logging.info(f"Number of choices: {len(result_json['choices'])}")
-            if result_json['choices']:
-                choice = result_json['choices'][0]
-                logging.info(f"First choice keys: {list(choice.keys())}")
-                if 'message' in choice:
-                    message = choice['message']
-                    logging.info(f"Message keys: {list(message.keys())}")
-                    logging.info(f"Message role: {message.get('role', 'N/A')}")
-                    content = message.get('content', '')
-                    logging.info(f"Content length: {len(content)}")
-                    logging.info(f"Content type: {type(content)}")
-                    if content:
-                        logging.info(f"Content first 200 chars: {content[:200]}")
-                    else:
-                        logging.info("CONTENT IS EMPTY OR NULL!")
-                else:
-                    logging.info("No 'message' key in choice!")
-            else:
-                logging.info("Choices array is empty!")
-        else:
-            logging.info("No 'choices' key in response!")
-        
-        if 'usage' in result_json:
-            logging.info(f"Token usage: {result_json['usage']}")
-        
-        logging.info("=" * 80)
+        if usage:
+            logging.info("Token usage: %s", usage)
+            _log_prompt_cache(usage)
+        if not result:
+            raise Exception("No response content from OpenAI API")
         
-        result = result_json['choices'][0]['message']['content']
         logging.info("Compliance analysis completed successfully")
         
         # Debug: Show the AI report content in console
-        logging.info("=" * 80)
-        logging.info("AI COMPLIANCE REPORT CONTENT:")
-        logging.info("=" * 80)
-        logging.info(result)
-        logging.info("=" * 80)
-        logging.info(f"Report length: {len(result)} characters")
+        logging.debug("AI COMPLIANCE REPORT CONTENT:\n%s", result)
+        logging.info("Report length: %d characters", len(result))
         
+        # A delta report was built from the previous report, not from these
+        # documents alone, so it is not cached under their key
+        if delta:
+            if details is not None:
+                details["delta"] = True
+        else:
+            _response_cache_put(cache_key, result)
+        if DELTA_REVIEW and session_key:
+            _remember_submittal(session_key, spec_hash, block_hashes, result, delta)
         return result
 
     except Exception as e:
         logging.error(f"OpenAI API error: {str(e)}")
         raise Exception(f"Failed to analyze compliance: {str(e)}")
+
+
+_STREAM_DONE = object()
+
+def analyze_compliance_stream(project_spec_text, vendor_submittal_text, session_key=None, details=None):
+    """
+    Generator form of analyze_compliance: yields report text as it is produced.
+    The analysis runs on a worker thread; pieces are handed over through a queue.
+    Paths that do not stream (cache hits, chunked or per-model analysis) yield
+    the whole report once. Errors from the analysis are re-raised here.
+    """
+    pieces = queue.Queue()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["result"] = analyze_compliance(
+                project_spec_text, vendor_submittal_text, session_key=session_key, on_chunk=pieces.put,
+                details=details,
+            )
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            pieces.put(_STREAM_DONE)
+
+    threading.Thread(target=worker, name="compliance-stream", daemon=True).start()
+
+    streamed = False
+    while True:
+        piece = pieces.get()
+        if piece is _STREAM_DONE:
+            break
+        streamed = True
+        yield piece
+
+    if "error" in outcome:
+        raise outcome["error"]
+    if not streamed:
+        yield outcome["result"]
+
+
+# Batch statuses that have not produced their output files yet
+_BATCH_RUNNING_STATUSES = {"validating", "in_progress", "finalizing", "cancelling"}
+
+def build_batch_request(custom_id, project_spec_text, vendor_submittal_text):
+    """Build one Batch API input line for a compliance review."""
+    user_message = ''.join((
+        "PROJECT_SPEC:\n", clean_text(project_spec_text),
+        "\n\n---\n\nSUBMITTAL:\n", clean_text(vendor_submittal_text),
+    ))
+    return {
+        "custom_id": str(custom_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": OPENAI_MODEL,
+            "messages": [
+                _SYSTEM_MESSAGE,
+                {"role": "user", "content": user_message}
+            ],
+            **_completion_limit(),
+        },
+    }
+
+def submit_batch(batch_requests):
+    """
+    Upload batch input lines and start a Batch API job (half price, separate
+    rate limit, results within 24 hours). Returns the batch id.
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError(
+            "OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."
+        )
+
+    batch_file = b"\n".join(_dumps_payload(line) for line in batch_requests)
+    # Drop the session's JSON content type so requests sets the multipart boundary
+    upload = _HTTP_SESSION.post(
+        OPENAI_FILES_URL,
+        data={"purpose": "batch"},
+        files={"file": ("compliance_batch.jsonl", batch_file, "application/jsonl")},
+        headers={"Content-Type": None},
+        timeout=120,
+    )
+    if upload.status_code != 200:
+        raise Exception(f"OpenAI file upload error: {upload.status_code}")
+
+    batch = _HTTP_SESSION.post(
+        OPENAI_BATCHES_URL,
+        data=_dumps_payload({
+            "input_file_id": upload.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        }),
+        timeout=60,
+    )
+    if batch.status_code != 200:
+        raise Exception(f"OpenAI batch creation error: {batch.status_code}")
+
+    batch_id = batch.json()["id"]
+    logging.info("Submitted batch %s with %d request(s)", batch_id, len(batch_requests))
+    return batch_id
+
+def _batch_file_lines(file_id):
+    response = _HTTP_SESSION.get(f"{OPENAI_FILES_URL}/{file_id}/content", timeout=120)
+    if response.status_code != 200:
+        raise Exception(f"OpenAI file download error: {response.status_code}")
+    return [json.loads(line) for line in response.content.splitlines() if line.strip()]
+
+def fetch_batch_results(batch_id):
+    """
+    Check a Batch API job. Returns (status, results) where results is None
+    while the job is still running, otherwise {custom_id: report or Exception}.
+    Requests missing from the results did not run (expired or cancelled batch).
+    """
+    response = _HTTP_SESSION.get(f"{OPENAI_BATCHES_URL}/{batch_id}", timeout=60)
+    if response.status_code != 200:
+        raise Exception(f"OpenAI batch lookup error: {response.status_code}")
+
+    batch = response.json()
+    status = batch["status"]
+    if status in _BATCH_RUNNING_STATUSES:
+        return status, None
+
+    results = {}
+    for file_key in ("output_file_id", "error_file_id"):
+        if not batch.get(file_key):
+            continue
+        for item in _batch_file_lines(batch[file_key]):
+            result = item.get("response") or {}
+            body = result.get("body") or {}
+            if result.get("status_code") == 200 and body.get("choices"):
+                results[item["custom_id"]] = body["choices"][0]["message"]["content"]
+            else:
+                error = item.get("error") or body.get("error") or f"status {result.get('status_code')}"
+                results[item["custom_id"]] = Exception(f"OpenAI batch request failed: {error}")
+    return status, results
+
+
+# Semantic cache: reuse a past report when both documents embed within this
+# cosine similarity of an earlier review. Off unless SEMANTIC_CACHE_THRESHOLD
+# is set (e.g. 0.97), since near-identical submittals can differ in one model
+# number that changes the verdict.
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0")) or None
+EMBEDDING_MODEL = "text-embedding-3-small"
+_EMBEDDING_MAX_TOKENS = 8000
+
+def _truncate_for_embedding(text):
+    """Trim text to the embedding model's input limit."""
+    if _TOKEN_ENCODING is not None:
+        tokens = _TOKEN_ENCODING.encode(text, disallowed_special=())
+        if len(tokens) > _EMBEDDING_MAX_TOKENS:
+            return _TOKEN_ENCODING.decode(tokens[:_EMBEDDING_MAX_TOKENS])
+        return text
+    return text[:_EMBEDDING_MAX_TOKENS * 3]
+
+# Inputs sent per embeddings request; the endpoint embeds a whole array in
+# one call, so texts are batched rather than sent one request each
+EMBEDDING_BATCH_SIZE = 100
+
+def embed_texts(texts):
+    """Return one embedding vector per input text, in order."""
+    inputs = [_truncate_for_embedding(clean_text(text)) or " " for text in texts]
+    embeddings = []
+    for start in range(0, len(inputs), EMBEDDING_BATCH_SIZE):
+        payload = {
+            "model": EMBEDDING_MODEL,
+            "input": inputs[start:start + EMBEDDING_BATCH_SIZE],
+        }
+        response = _HTTP_SESSION.post(OPENAI_EMBEDDINGS_URL, data=_dumps_payload(payload), timeout=60)
+        if response.status_code != 200:
+            raise Exception(f"OpenAI embeddings error: {response.status_code}")
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        embeddings.extend(item["embedding"] for item in data)
+    return embeddings
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) * sum(y * y for y in b)) ** 0.5
+    return dot / norm if norm else 0.0
+
+
+# Structured output: the model returns JSON matching REPORT_SCHEMA and the
+# Markdown report is rendered locally, so no output tokens are spent on
+# formatting and the summary fields are read without parsing text
+STRUCTURED_OUTPUT = os.environ.get("STRUCTURED_OUTPUT", "0") == "1"
+
+_STATUS_VALUES = ["Compliant", "Partially Compliant", "Non-Compliant", "Insufficient Data"]
+
+def _string_list(description):
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+def _object(properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+REPORT_SCHEMA = _object({
+    "overall_status": {"type": "string", "enum": _STATUS_VALUES},
+    "executive_summary": _string_list("Additional concise summary bullets"),
+    "models": {
+        "type": "array",
+        "items": _object({
+            "model": {"type": "string", "description": "Model number exactly as in SUBMITTAL"},
+            "compliance_status": {"type": "string", "enum": _STATUS_VALUES},
+            "requirements": {
+                "type": "array",
+                "items": _object({
+                    "requirement": {"type": "string"},
+                    "actual": {"type": "string", "description": "Actual value/description with unit"},
+                    "submittal_reference": {"type": "string", "description": "SUBMITTAL page/section and short quote"},
+                    "marking": {"type": "string", "enum": ["GREEN", "YELLOW", "RED", "GRAY"]},
+                    "result": {"type": "string", "enum": ["EXCEEDS", "MEETS", "MARGINAL", "DOES NOT MEET", "INSUFFICIENT DATA"]},
+                    "project_reference": {"type": "string", "description": "PROJECT_SPEC page/section and short quote"},
+                }),
+            },
+            "critical_observations": _string_list("Limitations, ambiguous clauses, footnotes, assumptions"),
+            "final_rationale": {"type": "string", "description": "One-sentence rationale for the final status"},
+        }),
+    },
+    "risk_assessment": _object({
+        "marginal": _string_list("Marginally met specifications (YELLOW)"),
+        "missing_critical": _string_list("Missing critical information (GRAY)"),
+        "integration_issues": _string_list("Potential compatibility/integration issues"),
+    }),
+    "recommendations": _object({
+        "recommended_models": _string_list("Recommended model(s) for procurement"),
+        "additional_testing": _string_list("Additional testing/verification needed"),
+        "alternatives": _string_list("Suggested alternatives"),
+    }),
+    "critical_considerations": _object({
+        "safety_margins": {"type": "string"},
+        "environmental_conditions": {"type": "string"},
+        "codes_and_standards": {"type": "string"},
+        "lifecycle": {"type": "string"},
+        "interoperability": {"type": "string"},
+    }),
+    "documentation": _object({
+        "project_spec_citations": _string_list("PROJECT_SPEC page/section citations"),
+        "submittal_citations": _string_list("SUBMITTAL page/section citations"),
+        "direct_quotes": _string_list("Direct quotes for critical specs, <=30 words each"),
+        "metadata": _string_list("Titles and revision numbers/dates of both documents"),
+        "assumptions": _string_list("Assumptions made"),
+    }),
+})
+
+_STRUCTURED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "compliance_report", "strict": True, "schema": REPORT_SCHEMA},
+}
+
+_STRUCTURED_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+---
+## Structured Output Mode
+This mode overrides the Strict Output Format and Output Constraints above.
+* Return the report as a JSON object matching the provided response schema instead of Markdown.
+* Each field carries the content of the section of the same name; each entry in requirements is one Specification Review line.
+* Apply the same methodology, marking system, citation and overall status rules.
+"""
+_STRUCTURED_SYSTEM_MESSAGE = {"role": "system", "content": clean_text(_STRUCTURED_SYSTEM_PROMPT)}
+
+_QA_CHECKLIST = [
+    "All model numbers/variants evaluated",
+    "Every project requirement addressed",
+    "Units standardized; conversions shown",
+    'Tolerances and test conditions noted (e.g., "at 20 degrees C", "sea level")',
+    "Conditional specifications and footnotes called out",
+    "Professional engineering judgment applied to marginal cases",
+]
+
+def report_summary(data):
+    """Return (overall_status, models_reviewed, compliant_models) from a structured report."""
+    models = data["models"]
+    compliant = sum(1 for model in models if model["compliance_status"] == "Compliant")
+    return data["overall_status"], len(models), compliant
+
+def render_report_markdown(data):
+    """Render a structured report in the Strict Output Format of SYSTEM_PROMPT."""
+    overall_status, models_reviewed, compliant_models = report_summary(data)
+
+    def bullets(items, empty="None"):
+        return [f"* {item}" for item in items] or [f"* {empty}"]
+
+    def labelled(label, items):
+        return f"* {label}: {'; '.join(items) if items else 'None'}"
+
+    lines = [
+        "# Executive Summary",
+        f"* Overall compliance status: {overall_status}",
+        f"* Number of models reviewed: {models_reviewed}",
+        f"* Number of compliant models identified: {compliant_models}",
+        *[f"* {item}" for item in data["executive_summary"]],
+        "",
+        "# Detailed Analysis by Model Number",
+    ]
+    for model in data["models"]:
+        lines += [
+            f"## Model: {model['model']}",
+            f"Compliance Status: {model['compliance_status']}",
+            "",
+            "Specification Review (Project Requirement -> Actual Spec -> Status):",
+        ]
+        for req in model["requirements"]:
+            lines.append(
+                f'* {req["requirement"]}: "{req["actual"]}" ({req["submittal_reference"]}). '
+                f'Status: [{req["marking"]}: {req["result"]}].'
+            )
+            lines.append(f"  Reference: {req['project_reference']}")
+        lines += ["", "Critical Observations:", *bullets(model["critical_observations"]), ""]
+
+    risk = data["risk_assessment"]
+    recommendations = data["recommendations"]
+    considerations = data["critical_considerations"]
+    documentation = data["documentation"]
+    lines += [
+        "# Risk Assessment",
+        labelled("Marginally met specifications (YELLOW)", risk["marginal"]),
+        labelled("Missing critical information (GRAY)", risk["missing_critical"]),
+        labelled("Potential compatibility/integration issues", risk["integration_issues"]),
+        "",
+        "# Compliance Assessment (by model)",
+        *[f"* {m['model']} -- {m['compliance_status']}: {m['final_rationale']}" for m in data["models"]],
+        "",
+        "# Engineering Recommendations",
+        labelled("Recommended model(s) for procurement", recommendations["recommended_models"]),
+        labelled("Additional testing/verification needed", recommendations["additional_testing"]),
+        labelled("Suggested alternatives", recommendations["alternatives"]),
+        "",
+        "# Critical Considerations",
+        f"* Safety Margins: {considerations['safety_margins']}",
+        f"* Environmental Conditions: {considerations['environmental_conditions']}",
+        f"* Codes & Standards: {considerations['codes_and_standards']}",
+        f"* Lifecycle Considerations: {considerations['lifecycle']}",
+        f"* Interoperability: {considerations['interoperability']}",
+        "",
+        "# Documentation Requirements",
+        labelled("PROJECT_SPEC citation list", documentation["project_spec_citations"]),
+        labelled("SUBMITTAL citation list", documentation["submittal_citations"]),
+        labelled("Direct quotes for critical specs", documentation["direct_quotes"]),
+        labelled("Document metadata", documentation["metadata"]),
+        labelled("Assumptions made", documentation["assumptions"]),
+        "",
+        "# Quality Assurance Checklist",
+        *[f"* [CHECK] {item}" for item in _QA_CHECKLIST],
+    ]
+    return "\n".join(lines)
+
+def analyze_compliance_structured(project_spec_text, vendor_submittal_text):
+    """
+    Analyze with structured output and return the report as a dict matching
+    REPORT_SCHEMA, or None when the documents are too large for one request
+    (callers then fall back to the chunked Markdown analysis).
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError(
+            "OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."
+        )
+
+    project_spec_text = clean_text(project_spec_text)
+    vendor_submittal_text = clean_text(vendor_submittal_text)
+    if count_tokens(project_spec_text) + count_tokens(vendor_submittal_text) > MAX_REQUEST_TOKENS - _SYSTEM_PROMPT_TOKENS:
+        return None
+
+    user_message = ''.join((
+        "PROJECT_SPEC:\n", project_spec_text,
+        "\n\n---\n\nSUBMITTAL:\n", vendor_submittal_text,
+    ))
+    content = _post_completion(
+        user_message,
+        system_message=_STRUCTURED_SYSTEM_MESSAGE,
+        response_format=_STRUCTURED_RESPONSE_FORMAT,
+    )
+    return json.loads(content)
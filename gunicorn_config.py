@@ -1,12 +1,28 @@
 # Gunicorn configuration file
+# Shared by start_server.sh, the Replit workflow and the deployment command
+import multiprocessing
+import os
+
 bind = "0.0.0.0:5000"
-workers = 1
+reuse_port = True
+# Reviews run on background threads and long PDFs on a page process pool in
+# each worker, so requests themselves are short: a couple of threaded workers
+# is enough, and fewer workers means fewer split in-process caches.
+# WEB_CONCURRENCY overrides the worker count.
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = 4
+# Each worker has its own page pool, so split the cores between them rather
+# than giving every worker one process per core
+os.environ.setdefault("PDF_WORKERS", str(max(1, min(multiprocessing.cpu_count() // workers, 8))))
 timeout = 1200  # 20 minutes timeout for large document processing and file uploads
+# Let running background reviews finish (up to the analysis budget) when a
+# worker is stopped; reviews that never finish are failed by the stale sweep
+graceful_timeout = 1200
 client_timeout = 1200  # 20 minutes for client connections
-reload = True
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
-max_requests = 1000
-max_requests_jitter = 50
-worker_connections = 1000
\ No newline at end of file
+# No periodic worker recycling: it would stop background reviews mid-run
+max_requests = 0
+worker_connections = 1000
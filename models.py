@@ -2,7 +2,10 @@ from app import db
 from datetime import datetime
 from flask_login import UserMixin
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
-from sqlalchemy import UniqueConstraint
+import logging
+from sqlalchemy import UniqueConstraint, inspect, text
+from sqlalchemy.orm import deferred
+from sqlalchemy.schema import CreateIndex
 
 # User authentication models (required for Replit Auth)
 class User(UserMixin, db.Model):
@@ -17,7 +20,8 @@ class User(UserMixin, db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
     # Relationship to compliance reviews
-    compliance_reviews = db.relationship('ComplianceReview', backref='user', lazy=True)
+    # Dynamic so accessing it returns a query instead of loading every review
+    compliance_reviews = db.relationship('ComplianceReview', backref='user', lazy='dynamic')
 
 class OAuth(OAuthConsumerMixin, db.Model):
     user_id = db.Column(db.String, db.ForeignKey(User.id))
@@ -38,10 +42,64 @@ class ComplianceReview(db.Model):
     overall_status = db.Column(db.String(50), nullable=True)
     models_reviewed = db.Column(db.Integer, nullable=True)
     compliant_models = db.Column(db.Integer, nullable=True)
-    report_content = db.Column(db.Text, nullable=True)
+    # Large text columns are deferred: loaded on first access, not with list queries
+    report_content = deferred(db.Column(db.Text, nullable=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default='pending')  # pending, completed, error
-    error_message = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), default='pending', index=True)  # pending, completed, error
+    error_message = deferred(db.Column(db.Text, nullable=True))
+    batch_id = db.Column(db.String(64), nullable=True)  # OpenAI Batch API job for queued reviews
+    # JSON-encoded embeddings of the two documents, for the semantic report cache
+    spec_embedding = deferred(db.Column(db.Text, nullable=True))
+    submittal_embedding = deferred(db.Column(db.Text, nullable=True))
     
     # Link to the user who created the review
     user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=True)
+
+    # History lists filter by user and sort newest first
+    __table_args__ = (db.Index('ix_user_created', 'user_id', 'created_at'),)
+
+class ReportCache(db.Model):
+    """Completed reports keyed on a SHA-256 of the exact inputs (see report_cache_key)."""
+    __tablename__ = 'report_cache'
+    hash = db.Column(db.String(64), primary_key=True)
+    report_content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def upgrade_schema():
+    """
+    Add the columns and indexes that db.create_all() leaves out of tables
+    that already exist. Safe to run from several processes at once; new
+    columns must be nullable so existing rows stay valid.
+    """
+    engine = db.engine
+    postgres = engine.dialect.name == 'postgresql'
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        statements = []
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                logging.error(f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table")
+                continue
+            statements.append(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {'IF NOT EXISTS ' if postgres else ''}"
+                f"{column.name} {column.type.compile(engine.dialect)}"
+            ))
+        for index in table.indexes:
+            if index.name not in indexes:
+                statements.append(CreateIndex(index, if_not_exists=True))
+        for statement in statements:
+            # One transaction each, so a column another process added first
+            # (SQLite has no ADD COLUMN IF NOT EXISTS) doesn't undo the rest
+            try:
+                with engine.begin() as connection:
+                    connection.execute(statement)
+                logging.info(f"Schema upgrade: {statement}")
+            except Exception as e:
+                logging.warning(f"Schema upgrade step skipped: {str(e)}")
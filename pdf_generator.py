@@ -16,6 +16,85 @@ import markdown
 import logging
 
 
+# Styles are built once at import; reportlab style construction is not cheap
+_STYLES = getSampleStyleSheet()
+
+# Custom styles for professional look
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Title'],
+    fontSize=18,
+    spaceAfter=20,
+    textColor=colors.HexColor('#1e3a8a'),
+    alignment=TA_CENTER
+)
+
+_HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_STYLES['Heading1'],
+    fontSize=14,
+    spaceAfter=12,
+    spaceBefore=16,
+    textColor=colors.HexColor('#1e3a8a'),
+    borderWidth=1,
+    borderColor=colors.HexColor('#e2e8f0'),
+    borderPadding=8,
+    backColor=colors.HexColor('#f8fafc')
+)
+
+_SUBHEADING_STYLE = ParagraphStyle(
+    'CustomSubheading',
+    parent=_STYLES['Heading2'],
+    fontSize=12,
+    spaceAfter=8,
+    spaceBefore=12,
+    textColor=colors.HexColor('#374151'),
+    leftIndent=12
+)
+
+_BODY_STYLE = ParagraphStyle(
+    'CustomBody',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    spaceAfter=6,
+    textColor=colors.HexColor('#1f2937'),
+    alignment=TA_JUSTIFY
+)
+
+_BULLET_STYLE = ParagraphStyle(
+    'CustomBullet',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    spaceAfter=4,
+    leftIndent=20,
+    bulletIndent=12,
+    textColor=colors.HexColor('#1f2937')
+)
+
+_FOOTER_STYLE = ParagraphStyle(
+    'Footer',
+    parent=_STYLES['Normal'],
+    fontSize=8,
+    textColor=colors.HexColor('#6b7280'),
+    alignment=TA_CENTER
+)
+
+_DOC_INFO_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e5e7eb')),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+])
+
+
 def generate_compliance_pdf(report_content, review_data):
     """
     Generate a professional PDF from compliance report content
@@ -40,66 +119,11 @@ def generate_compliance_pdf(report_content, review_data):
         bottomMargin=18
     )
     
-    # Get default styles and create custom ones
-    styles = getSampleStyleSheet()
-    
-    # Custom styles for professional look
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Title'],
-        fontSize=18,
-        spaceAfter=20,
-        textColor=colors.HexColor('#1e3a8a'),
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading1'],
-        fontSize=14,
-        spaceAfter=12,
-        spaceBefore=16,
-        textColor=colors.HexColor('#1e3a8a'),
-        borderWidth=1,
-        borderColor=colors.HexColor('#e2e8f0'),
-        borderPadding=8,
-        backColor=colors.HexColor('#f8fafc')
-    )
-    
-    subheading_style = ParagraphStyle(
-        'CustomSubheading',
-        parent=styles['Heading2'],
-        fontSize=12,
-        spaceAfter=8,
-        spaceBefore=12,
-        textColor=colors.HexColor('#374151'),
-        leftIndent=12
-    )
-    
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=6,
-        textColor=colors.HexColor('#1f2937'),
-        alignment=TA_JUSTIFY
-    )
-    
-    bullet_style = ParagraphStyle(
-        'CustomBullet',
-        parent=styles['Normal'],
-        fontSize=10,
-        spaceAfter=4,
-        leftIndent=20,
-        bulletIndent=12,
-        textColor=colors.HexColor('#1f2937')
-    )
-    
     # Build the story (content) for the PDF
     story = []
     
     # Header section
-    story.append(Paragraph("Engineering Compliance Review Report", title_style))
+    story.append(Paragraph("Engineering Compliance Review Report", _TITLE_STYLE))
     story.append(Spacer(1, 12))
     
     # Document information table
@@ -114,20 +138,7 @@ def generate_compliance_pdf(report_content, review_data):
     ]
     
     doc_table = Table(doc_info, colWidths=[2*inch, 4*inch])
-    doc_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e5e7eb')),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
+    doc_table.setStyle(_DOC_INFO_TABLE_STYLE)
     
     story.append(doc_table)
     story.append(Spacer(1, 20))
@@ -138,29 +149,22 @@ def generate_compliance_pdf(report_content, review_data):
     # Convert processed content to PDF elements
     for element in processed_content:
         if element['type'] == 'heading1':
-            story.append(Paragraph(element['content'], heading_style))
+            story.append(Paragraph(element['content'], _HEADING_STYLE))
         elif element['type'] == 'heading2':
-            story.append(Paragraph(element['content'], subheading_style))
+            story.append(Paragraph(element['content'], _SUBHEADING_STYLE))
         elif element['type'] == 'heading3':
-            story.append(Paragraph(element['content'], subheading_style))
+            story.append(Paragraph(element['content'], _SUBHEADING_STYLE))
         elif element['type'] == 'paragraph':
-            story.append(Paragraph(element['content'], body_style))
+            story.append(Paragraph(element['content'], _BODY_STYLE))
         elif element['type'] == 'bullet':
-            story.append(Paragraph(f"• {element['content']}", bullet_style))
+            story.append(Paragraph(element['content'], _BULLET_STYLE))
         elif element['type'] == 'spacer':
             story.append(Spacer(1, 12))
     
     # Footer
     story.append(Spacer(1, 20))
     footer_text = f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')} by Engineering Compliance Review System"
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.HexColor('#6b7280'),
-        alignment=TA_CENTER
-    )
-    story.append(Paragraph(footer_text, footer_style))
+    story.append(Paragraph(footer_text, _FOOTER_STYLE))
     
     # Build the PDF
     doc.build(story)
@@ -174,7 +178,10 @@ def generate_compliance_pdf(report_content, review_data):
 
 def process_markdown_for_pdf(content):
     """
-    Process markdown content and convert to structured data for PDF generation
+    Process markdown content and convert to structured data for PDF generation.
+    Consecutive paragraph lines are merged into one element joined with <br/>
+    so each run becomes a single Paragraph. Bullets stay one element each so
+    every item keeps its own spacing and hanging indent.
     """
     elements = []
     lines = content.split('\n')
@@ -194,35 +201,54 @@ def process_markdown_for_pdf(content):
         elif line.startswith('### '):
             elements.append({'type': 'heading3', 'content': format_compliance_badges(line[4:])})
         # Bullet points
-        elif line.startswith('* '):
-            elements.append({'type': 'bullet', 'content': format_compliance_badges(line[2:])})
-        elif line.startswith('- '):
-            elements.append({'type': 'bullet', 'content': format_compliance_badges(line[2:])})
+        elif line.startswith('* ') or line.startswith('- '):
+            elements.append({'type': 'bullet', 'content': f"• {format_compliance_badges(line[2:])}"})
         # Regular paragraphs
         else:
-            elements.append({'type': 'paragraph', 'content': format_compliance_badges(line)})
+            _append_paragraph(elements, format_compliance_badges(line))
+    
+    # Paragraph runs collect their lines in a list and are joined once at the end
+    for element in elements:
+        if 'lines' in element:
+            element['content'] = "<br/>\n".join(element.pop('lines'))
     
     return elements
 
 
+def _append_paragraph(elements, content):
+    """Append a paragraph line, joining it onto the previous element if that is a paragraph."""
+    if elements and elements[-1]['type'] == 'paragraph':
+        elements[-1]['lines'].append(content)
+    else:
+        elements.append({'type': 'paragraph', 'lines': [content]})
+
+
+_BADGE_COLORS = {
+    'GREEN': '#10b981',
+    'YELLOW': '#f59e0b',
+    'RED': '#ef4444',
+    'GRAY': '#6b7280',
+}
+
+# Compiled once at import; format_compliance_badges runs for every report line
+_BADGE_RE = re.compile(r'\[(GREEN|YELLOW|RED|GRAY)(?::[^\]]+)?\]')
+_BOLD_RE = re.compile(r'\*\*([^*]+)\*\*')
+_ITALIC_RE = re.compile(r'\*([^*]+)\*')
+
+
+def _badge_sub(match):
+    return f'<font color="{_BADGE_COLORS[match.group(1)]}"><b>{match.group(0)}</b></font>'
+
+
 def format_compliance_badges(text):
     """
     Convert compliance status markers to HTML with colors for PDF
     """
-    # Handle detailed compliance markers
-    text = re.sub(r'\[GREEN:([^\]]+)\]', r'<font color="#10b981"><b>[GREEN:\1]</b></font>', text)
-    text = re.sub(r'\[YELLOW:([^\]]+)\]', r'<font color="#f59e0b"><b>[YELLOW:\1]</b></font>', text)
-    text = re.sub(r'\[RED:([^\]]+)\]', r'<font color="#ef4444"><b>[RED:\1]</b></font>', text)
-    text = re.sub(r'\[GRAY:([^\]]+)\]', r'<font color="#6b7280"><b>[GRAY:\1]</b></font>', text)
-    
-    # Handle simple compliance markers as fallback
-    text = re.sub(r'\[GREEN\]', r'<font color="#10b981"><b>[GREEN]</b></font>', text)
-    text = re.sub(r'\[YELLOW\]', r'<font color="#f59e0b"><b>[YELLOW]</b></font>', text)
-    text = re.sub(r'\[RED\]', r'<font color="#ef4444"><b>[RED]</b></font>', text)
-    text = re.sub(r'\[GRAY\]', r'<font color="#6b7280"><b>[GRAY]</b></font>', text)
+    # Handle detailed ([GREEN:note]) and simple ([GREEN]) compliance markers
+    text = _BADGE_RE.sub(_badge_sub, text)
     
     # Format bold text
-    text = re.sub(r'\*\*([^*]+)\*\*', r'<b>\1</b>', text)
-    text = re.sub(r'\*([^*]+)\*', r'<i>\1</i>', text)
+    text = _BOLD_RE.sub(r'<b>\1</b>', text)
+    text = _ITALIC_RE.sub(r'<i>\1</i>', text)
     
-    return text
\ No newline at end of file
+    return text
@@ -1,6 +1,15 @@
+import os
+
+# Tesseract's OpenMP threading is inefficient; pages are parallelized across
+# processes and threads instead. Set before tesseract is loaded, and inherited
+# by tesseract subprocesses and page pool processes.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import logging
 import pdfplumber
+import pypdfium2
 import pytesseract
+from pdfminer.layout import LAParams, LTContainer, LTCurve, LTTextLine
 from PIL import Image
 import io
 import re
@@ -8,12 +17,194 @@ import unicodedata
 import platform
 import threading
 import signal
-import string
+import hashlib
+import subprocess
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+try:
+    import easyocr
+    import numpy
+except ImportError:
+    easyocr = None
 
 # Disable debug logging for PDF libraries
 logging.getLogger('pdfminer').setLevel(logging.WARNING)
 logging.getLogger('pdfplumber').setLevel(logging.WARNING)
 
+# Processes used to extract pages of multi-page PDFs in parallel; 1 disables the pool
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+# Pool processes are spawned, not forked: the gunicorn worker that calls in runs
+# several threads, and forking a threaded process can deadlock the child
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Spawning a process and importing pdfplumber into it costs far more than
+# parsing a short document, so pdfplumber only uses the pool for documents of
+# at least PDF_POOL_MIN_PAGES pages. PyMuPDF parses digital pages inline and
+# sends every page that needs OCR to the pool regardless of length: rendering
+# and OCR take seconds per page, well above a pool process's start-up, and
+# only the pool lets several such pages run at once. The pool is created on
+# first use and shared by every document this process extracts, which also
+# caps their combined page workers at PDF_WORKERS; its processes start as
+# pages need them.
+PDF_POOL_MIN_PAGES = int(os.environ.get("PDF_POOL_MIN_PAGES", "16"))
+_PAGE_POOL = None
+_PAGE_POOL_LOCK = threading.Lock()
+
+def _page_pool():
+    global _PAGE_POOL
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is None:
+            _PAGE_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=_MP_CONTEXT)
+        return _PAGE_POOL
+
+def _discard_page_pool(executor):
+    """Drop a pool broken by a dead worker (e.g. OOM-killed) so the next document gets a new one."""
+    global _PAGE_POOL
+    with _PAGE_POOL_LOCK:
+        if _PAGE_POOL is executor:
+            _PAGE_POOL = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# Text extraction backend: "pymupdf" (default) or "pdfplumber". pdfplumber stays
+# the fallback when PyMuPDF is not installed or cannot open a file, and for
+# pages that need OCR.
+PDF_BACKEND = os.environ.get("PDF_BACKEND", "pymupdf").lower()
+
+# Table detection is the most expensive per-page step; EXTRACT_TABLES=0 skips it
+# for deployments whose documents are table-light
+EXTRACT_TABLES = os.environ.get("EXTRACT_TABLES", "1") == "1"
+
+# Strip page banners and repeated headers/footers from the extracted text.
+# Opt-in: a header/footer heuristic can drop real specification lines
+COMPRESS_EXTRACTED = os.environ.get("COMPRESS_EXTRACTED", "0") == "1"
+
+# OCR render resolution. Pages whose partial text layer shows small print
+# (median font under OCR_SMALL_FONT_PT) are rendered at OCR_SMALL_FONT_DPI.
+OCR_DPI = int(os.environ.get("OCR_DPI", "150"))
+OCR_SMALL_FONT_DPI = 200
+OCR_SMALL_FONT_PT = 9
+
+# Comprehensive Unicode replacements - covers PDF common characters
+_REPLACEMENTS = {
+    # Quotes and punctuation
+    '\u2019': "'",  # Right single quotation mark
+    '\u2018': "'",  # Left single quotation mark
+    '\u201c': '"',  # Left double quotation mark
+    '\u201d': '"',  # Right double quotation mark
+    '\u2013': '-',  # En dash
+    '\u2014': '--', # Em dash
+    '\u2026': '...',  # Ellipsis
+
+    # Mathematical and scientific
+    '\u00b0': ' degrees',  # Degree symbol
+    '\u00bd': '1/2',  # Half
+    '\u00bc': '1/4',  # Quarter
+    '\u00be': '3/4',  # Three quarters
+    '\u00b2': '^2',  # Superscript 2
+    '\u00b3': '^3',  # Superscript 3
+    '\u2022': '*',  # Bullet
+    '\u00d7': 'x',  # Multiplication
+    '\u00f7': '/',  # Division
+    '\u03bc': 'micro',  # Micro/mu
+    '\u00b1': '+/-',  # Plus-minus
+    '\u2265': '>=',  # Greater than or equal
+    '\u2264': '<=',  # Less than or equal
+    '\u2260': '!=',  # Not equal
+    '\u2248': '~=',  # Approximately equal
+    '\u221a': 'sqrt',  # Square root
+    '\u221e': 'infinity',  # Infinity
+    '\u03c0': 'pi',  # Pi
+    '\u03b1': 'alpha',  # Alpha
+    '\u03b2': 'beta',  # Beta
+    '\u03b3': 'gamma',  # Gamma
+    '\u03b4': 'delta',  # Delta
+    '\u03a9': 'Omega',  # Omega
+
+    # Symbols and marks
+    '\u00a9': '(c)',  # Copyright
+    '\u00ae': '(R)',  # Registered
+    '\u2122': '(TM)',  # Trademark
+    '\u00a7': 'Section ',  # Section sign
+    '\u2020': '+',  # Dagger
+    '\u2021': '++',  # Double dagger
+    '\u00b6': '[P]',  # Pilcrow (paragraph sign)
+    '\u2030': ' per thousand',  # Per mille
+    '\u00ba': ' degrees',  # Masculine ordinal
+    '\u00aa': 'a',  # Feminine ordinal
+    '\u2032': "'",  # Prime
+    '\u2033': '"',  # Double prime
+    '\u2034': "'''",  # Triple prime
+    '\u00b5': 'micro',  # Micro sign
+
+    # Whitespace and separators
+    '\u00a0': ' ',  # Non-breaking space
+    '\ufeff': '',  # Zero width no-break space (BOM)
+    '\u200b': '',  # Zero width space
+    '\u200c': '',  # Zero width non-joiner
+    '\u200d': '',  # Zero width joiner
+    '\u2028': '\n',  # Line separator
+    '\u2029': '\n\n',  # Paragraph separator
+    '\t': ' ',  # Tab
+    '\r': '',  # Carriage return
+}
+
+# Box-drawing characters that layout=True might add
+_BOX_CHARS = '│├─└┘┌┐┤┬┴┼╭╮╯╰╱╲╳┇┆┊┋'
+
+# All replacements in one table so str.translate does them in a single
+# C-level pass. Remaining ASCII control characters become spaces, except
+# \v and \f, which are dropped.
+_CLEAN_TABLE = str.maketrans(_REPLACEMENTS)
+_CLEAN_TABLE.update({ord(char): None for char in _BOX_CHARS})
+_CLEAN_TABLE.update({code: ' ' for code in [*range(32), 0x7F] if chr(code) not in '\n\t\r\x0b\x0c'})
+_CLEAN_TABLE.update({0x0B: None, 0x0C: None})
+
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+class _NFKDTable(dict):
+    """
+    str.translate table giving, for any character, what NFKD normalization and
+    then the base table make of it, with anything still outside ASCII as a
+    space. Each character is worked out on first use and kept, so cleaning is
+    one translate pass instead of normalizing the whole text first.
+    """
+    def __init__(self, base):
+        super().__init__()
+        self.base = base
+    
+    def __missing__(self, code):
+        value = unicodedata.normalize('NFKD', chr(code)).translate(self.base)
+        if not value.isascii():
+            value = _NON_ASCII_RE.sub(' ', value)
+        self[code] = value
+        return value
+# Tabs are already spaces after _CLEAN_TABLE, so only runs of two or more
+# spaces need replacing; the literal prefix lets the regex engine skip ahead
+_MULTI_SPACE_RE = re.compile(r'  +')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+# The lookahead rejects non-whitespace positions before trying either branch
+_LINE_EDGE_WS_RE = re.compile(r'(?=\s)(?:^\s+|\s+$)', re.MULTILINE)
+
+def _whitespace_cleanup(text):
+    text = _MULTI_SPACE_RE.sub(' ', text)  # Runs of spaces to a single space
+    text = _BLANK_LINES_RE.sub('\n\n', text)  # Multiple newlines to double
+    text = _LINE_EDGE_WS_RE.sub('', text)  # Trim line starts/ends
+    return text.strip()
+
 def clean_text_for_api(text):
     """
     Enhanced cleaning with comprehensive Unicode replacement
@@ -22,111 +213,628 @@ def clean_text_for_api(text):
         return ""
     
     # Convert to string if not already
-    text = str(text)
+    return _clean(str(text), _CLEAN_NFKD_TABLE)
+
+def _clean(text, table):
+    # Normalize, apply replacements, strip box-drawing and control characters
+    # and blank out anything left outside ASCII, all in one pass
+    return _whitespace_cleanup(text.translate(table))
+
+_CLEAN_NFKD_TABLE = _NFKDTable(_CLEAN_TABLE)
+
+# Table rows are cleaned in one pass with their cells joined by BEL, which the
+# row table leaves alone. It is neither whitespace nor touched by any of the
+# cleanup regexes, so each cell cleans exactly as it would on its own.
+_CELL_SEP = '\x07'
+_ROW_CLEAN_TABLE = dict(_CLEAN_TABLE)
+del _ROW_CLEAN_TABLE[ord(_CELL_SEP)]
+_ROW_CLEAN_NFKD_TABLE = _NFKDTable(_ROW_CLEAN_TABLE)
+
+def _clean_row(row):
+    """clean_text_for_api applied to every cell of a table row."""
+    # A BEL inside a cell would become a space anyway
+    joined = _CELL_SEP.join(str(cell).replace(_CELL_SEP, ' ') if cell else "" for cell in row)
+    return [cell.strip() for cell in _clean(joined, _ROW_CLEAN_NFKD_TABLE).split(_CELL_SEP)]
+
+_DOC_HEADER_RE = re.compile(r'={60}\nDOCUMENT CONTENT EXTRACTION\n={60}')
+_PAGE_MARKER_RE = re.compile(r'={50}\nPAGE (\d+)\n={50}(?:==DIGITAL TEXT EXTRACTION==)?')
+_PAGE_SPLIT_RE = re.compile(r'(\n--- PAGE \d+ ---\n)')
+# Only literal page footers; bare numbers and fractions such as "3/4" are data
+_PAGE_NUMBER_RE = re.compile(r'^page\s+\d+(?:\s+of\s+\d+)?$', re.IGNORECASE)
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+# Only runs that actually change: a lone space matches nothing, so already
+# clean text is scanned without building a replacement per word gap
+_SPACES_RE = re.compile(r'(?: [ \t]|\t)[ \t]*')
+
+# Lines within this many lines of a page edge are header/footer candidates
+_EDGE_LINES = 3
+# A header/footer must repeat on at least this many pages (and on half of
+# them) to be dropped, and be this long unless it is a page number, so short
+# repeated values are kept. Table rows are never dropped.
+_MIN_REPEATS = 3
+_MIN_BOILERPLATE_CHARS = 20
+
+def compress_extracted(text):
+    """
+    Shrink extracted text before it is sent to the API: replace the banner
+    page markers with short ones, drop the digital-text marker, and remove
+    header/footer lines repeated at the edges of many pages. Page-number
+    footers ("Page 3 of 10") all count as one repeated line; table rows are
+    always kept. The first occurrence of each repeated line is kept.
+    """
+    if not text:
+        return ""
     
-    # First normalize Unicode to decomposed form
-    try:
-        text = unicodedata.normalize('NFKD', text)
-    except Exception:
-        pass
+    text = _DOC_HEADER_RE.sub('', text)
+    text = _PAGE_MARKER_RE.sub(lambda m: f"\n--- PAGE {m.group(1)} ---\n", text)
+    text = _SPACES_RE.sub(' ', text)
     
-    # Comprehensive Unicode replacements - covers PDF common characters
-    replacements = {
-        # Quotes and punctuation
-        '\u2019': "'",  # Right single quotation mark
-        '\u2018': "'",  # Left single quotation mark
-        '\u201c': '"',  # Left double quotation mark
-        '\u201d': '"',  # Right double quotation mark
-        '\u2013': '-',  # En dash
-        '\u2014': '--', # Em dash
-        '\u2026': '...',  # Ellipsis
-        
-        # Mathematical and scientific
-        '\u00b0': ' degrees',  # Degree symbol
-        '\u00bd': '1/2',  # Half
-        '\u00bc': '1/4',  # Quarter
-        '\u00be': '3/4',  # Three quarters
-        '\u00b2': '^2',  # Superscript 2
-        '\u00b3': '^3',  # Superscript 3
-        '\u2022': '*',  # Bullet
-        '\u00d7': 'x',  # Multiplication
-        '\u00f7': '/',  # Division
-        '\u03bc': 'micro',  # Micro/mu
-        '\u00b1': '+/-',  # Plus-minus
-        '\u2265': '>=',  # Greater than or equal
-        '\u2264': '<=',  # Less than or equal
-        '\u2260': '!=',  # Not equal
-        '\u2248': '~=',  # Approximately equal
-        '\u221a': 'sqrt',  # Square root
-        '\u221e': 'infinity',  # Infinity
-        '\u03c0': 'pi',  # Pi
-        '\u03b1': 'alpha',  # Alpha
-        '\u03b2': 'beta',  # Beta
-        '\u03b3': 'gamma',  # Gamma
-        '\u03b4': 'delta',  # Delta
-        '\u03a9': 'Omega',  # Omega
-        
-        # Symbols and marks
-        '\u00a9': '(c)',  # Copyright
-        '\u00ae': '(R)',  # Registered
-        '\u2122': '(TM)',  # Trademark
-        '\u00a7': 'Section ',  # Section sign
-        '\u2020': '+',  # Dagger
-        '\u2021': '++',  # Double dagger
-        '\u00b6': '[P]',  # Pilcrow (paragraph sign)
-        '\u2030': ' per thousand',  # Per mille
-        '\u00ba': ' degrees',  # Masculine ordinal
-        '\u00aa': 'a',  # Feminine ordinal
-        '\u2032': "'",  # Prime
-        '\u2033': '"',  # Double prime
-        '\u2034': "'''",  # Triple prime
-        '\u00b5': 'micro',  # Micro sign
+    # Pages alternate with their markers after the split. Only a page's edge
+    # lines are kept between passes and pages are split into lines one at a
+    # time, so the whole document is never held as separate line strings.
+    parts = _PAGE_SPLIT_RE.split(text)
+    
+    def boilerplate_key(line):
+        line = line.strip()
+        if _PAGE_NUMBER_RE.match(line):
+            return '#page-number'
+        if '|' in line or _CELL_SEP in line:
+            return None
+        return line if len(line) >= _MIN_BOILERPLATE_CHARS else None
+    
+    def edge_keys(page):
+        lines = page.split('\n')
+        indexes = [i for i, line in enumerate(lines) if line.strip()]
+        edges = sorted(set(indexes[:_EDGE_LINES] + indexes[-_EDGE_LINES:]))
+        return [(i, boilerplate_key(lines[i])) for i in edges]
+    
+    page_edges = [edge_keys(page) for page in parts[0::2]]
+    counts = {}
+    for edges in page_edges:
+        for key in {key for _, key in edges} - {None}:
+            counts[key] = counts.get(key, 0) + 1
+    min_repeats = max(_MIN_REPEATS, (len(page_edges) + 1) // 2)
+    repeated = {key for key, count in counts.items() if count >= min_repeats}
+    
+    if repeated:
+        seen = set()
+        for page_index, edges in enumerate(page_edges):
+            blank = []
+            for i, key in edges:
+                if key in repeated:
+                    if key in seen:
+                        blank.append(i)
+                    seen.add(key)
+            if blank:
+                lines = parts[2 * page_index].split('\n')
+                for i in blank:
+                    lines[i] = ''
+                parts[2 * page_index] = '\n'.join(lines)
+    
+    text = _EXTRA_NEWLINES_RE.sub('\n\n', ''.join(parts))
+    return text.strip()
+
+def extract_with_timeout(func, timeout, *args, **kwargs):
+    """
+    Run func with a time limit. SIGALRM is used where available (Unix, main
+    thread); otherwise func runs on a daemon thread that is abandoned on timeout.
+    """
+    if platform.system() != 'Windows' and threading.current_thread() is threading.main_thread():
+        def timeout_handler(signum, frame):
+            raise TimeoutError(f"Timed out after {timeout} seconds")
         
-        # Whitespace and separators
-        '\u00a0': ' ',  # Non-breaking space
-        '\ufeff': '',  # Zero width no-break space (BOM)
-        '\u200b': '',  # Zero width space
-        '\u200c': '',  # Zero width non-joiner
-        '\u200d': '',  # Zero width joiner
-        '\u2028': '\n',  # Line separator
-        '\u2029': '\n\n',  # Paragraph separator
-        '\t': ' ',  # Tab
-        '\r': '',  # Carriage return
-    }
+        previous_handler = signal.signal(signal.SIGALRM, timeout_handler)
+        signal.alarm(timeout)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
     
-    # Apply replacements
-    for unicode_char, ascii_char in replacements.items():
-        text = text.replace(unicode_char, ascii_char)
+    result = {}
+    def target():
+        try:
+            result['value'] = func(*args, **kwargs)
+        except Exception as e:
+            result['error'] = e
     
-    # Remove box-drawing characters that layout=True might add
-    box_chars = '│├─└┘┌┐┤┬┴┼╭╮╯╰╱╲╳┇┆┊┋'
-    for char in box_chars:
-        text = text.replace(char, '')
+    worker = threading.Thread(target=target, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        raise TimeoutError(f"Timed out after {timeout} seconds")
+    if 'error' in result:
+        raise result['error']
+    return result.get('value')
+
+def _render_table(table) -> str:
+    """Render a table (a list of rows of cells) as cleaned, pipe-separated lines."""
+    return '\n'.join(
+        " | ".join(_clean_row(row))
+        for row in table if row
+    )
+
+def _append_tables(page_content, tables):
+    """Append tables to page_content, one entry per table."""
+    if tables:
+        page_content.append("\n==TABLES FOUND==")
+        for idx, table in enumerate(tables, 1):
+            if table:
+                page_content.append(f"\nTable {idx}:")
+                if any(table):
+                    page_content.append(_render_table(table))
+
+def _needs_ocr(page, page_text) -> bool:
+    """
+    Whether a page (pdfplumber or PyMuPDF) needs OCR: it has too little digital
+    text, and either no text layer at all or an image that may hold scanned text.
+    Pages with a short text layer and no images (dividers, near-blank pages)
+    have nothing more for OCR to find.
+    """
+    page_text = (page_text or '').strip()
+    if len(page_text) > 50:
+        return False
+    if not page_text:
+        return True
+    images = page.get_images() if hasattr(page, "get_images") else page.images
+    return bool(images)
+
+# OCR on the GPU with EasyOCR instead of tesseract. Every process loads its
+# own model onto the GPU, so keep PDF_WORKERS small when enabling this.
+USE_GPU_OCR = os.environ.get("USE_GPU_OCR", "0") == "1"
+_EASYOCR_READER = None
+_EASYOCR_LOCK = threading.Lock()
+
+def _easyocr_reader():
+    """This process's EasyOCR reader, loaded on first use."""
+    global _EASYOCR_READER
+    with _EASYOCR_LOCK:
+        if _EASYOCR_READER is None:
+            _EASYOCR_READER = easyocr.Reader(['en'], gpu=True)
+    return _EASYOCR_READER
+
+# Directory of tesseract models to use instead of the installed ones, e.g. a
+# copy of tessdata_fast, whose integer models read clean print 2-3x faster
+TESSDATA_DIR = os.environ.get("TESSDATA_DIR")
+
+# OCR with better configuration for text preservation. LSTM engine only: the
+# fast models carry no legacy-engine data.
+_TESSERACT_ARGS = ['-l', 'eng', '--oem', '1', '--psm', '6', '-c', 'preserve_interword_spaces=0']
+if TESSDATA_DIR:
+    _TESSERACT_ARGS += ['--tessdata-dir', TESSDATA_DIR]
+_TESSERACT = threading.local()
+
+def _tesseract_api():
+    """
+    This thread's persistent tesserocr instance, so the language model is
+    loaded once per thread or pool process rather than once per page.
+    """
+    api = getattr(_TESSERACT, 'api', None)
+    if api is None:
+        kwargs = {'path': TESSDATA_DIR} if TESSDATA_DIR else {}
+        api = tesserocr.PyTessBaseAPI(
+            lang='eng', psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.LSTM_ONLY,
+            variables={'preserve_interword_spaces': '0'}, **kwargs,
+        )
+        _TESSERACT.api = api
+    return api
+
+def _ocr_image(img, timeout):
+    """
+    OCR a PIL image with EasyOCR on the GPU when USE_GPU_OCR is set, else with
+    tesserocr when installed, else a tesseract subprocess.
+    Returns None if tesseract does not finish within timeout seconds.
+    """
+    if USE_GPU_OCR and easyocr is not None:
+        reader = _easyocr_reader()
+        # Text-line crops of the page are recognized in batches of 8; one page
+        # at a time per process so request threads don't contend for the GPU
+        with _EASYOCR_LOCK:
+            lines = reader.readtext(numpy.asarray(img), detail=0, paragraph=True, batch_size=8)
+        return '\n'.join(lines)
     
-    # More aggressive cleaning - keep only printable ASCII characters plus newlines and tabs
-    printable = set(string.printable)
-    text = ''.join(char if char in printable else ' ' for char in text)
+    if tesserocr is not None:
+        api = _tesseract_api()
+        api.SetImage(img)
+        if not api.Recognize(timeout=timeout * 1000):
+            return None
+        return api.GetUTF8Text()
     
-    # Remove control characters except \n, \r, \t
-    text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\r\t')
+    # The image goes to tesseract as PNG on stdin and the text comes back on
+    # stdout, skipping the temp files pytesseract writes and reads per page.
+    # subprocess.run kills tesseract on timeout, from any thread or pool process.
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    try:
+        result = subprocess.run(
+            [pytesseract.pytesseract.tesseract_cmd, 'stdin', 'stdout', *_TESSERACT_ARGS],
+            input=buffer.getvalue(), capture_output=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0:
+        raise RuntimeError(f"tesseract exited with status {result.returncode}: "
+                           f"{result.stderr.decode('utf-8', 'replace').strip()}")
+    return result.stdout.decode('utf-8', 'replace')
+
+def _ocr_resolution(page):
+    """Render resolution for OCR: OCR_DPI, or higher when the page's text is small."""
+    sizes = sorted(char["size"] for char in page.chars)
+    if sizes and sizes[len(sizes) // 2] < OCR_SMALL_FONT_PT:
+        return max(OCR_DPI, OCR_SMALL_FONT_DPI)
+    return OCR_DPI
+
+# pdfminer's own grouping; text inside figures is kept, as pdfplumber does
+_TEXT_LAPARAMS = LAParams(detect_vertical=False, all_texts=True)
+# Lines whose tops are this close (in points) read as one row
+_LINE_Y_TOLERANCE = 3
+
+def _has_ruling_lines(objs):
+    # LTRect and LTLine are LTCurve subclasses
+    for obj in objs:
+        if isinstance(obj, LTCurve):
+            return True
+        if isinstance(obj, LTContainer) and _has_ruling_lines(obj):
+            return True
+    return False
+
+def _pdfplumber_text(page):
+    """
+    Digital text of a pdfplumber page and whether it has ruling lines, which
+    table detection needs. The text comes from pdfminer's layout analysis of
+    the layout pdfplumber already parsed, so pdfplumber's per-character
+    objects are only built for pages that may hold a table.
+    """
+    layout = page.layout
+    ruled = _has_ruling_lines(layout)
+    if ruled and EXTRACT_TABLES:
+        # Tables must read the characters as parsed, before analysis regroups them
+        page.objects
+    layout.analyze(_TEXT_LAPARAMS)
     
-    # Final safety net - ensure pure ASCII
-    text = text.encode('ascii', errors='ignore').decode('ascii')
+    # pdfminer groups table columns into separate boxes; lines are put back
+    # in reading order instead, merging those that share a baseline as
+    # pdfplumber does
+    lines = sorted(_layout_lines(layout), key=lambda line: (-line.y1, line.x0))
+    rows = []
+    top = None
+    for line in lines:
+        text = line.get_text().strip()
+        if not text:
+            continue
+        if top is not None and top - line.y1 <= _LINE_Y_TOLERANCE:
+            rows[-1].append(line)
+        else:
+            rows.append([line])
+            top = line.y1
+    return '\n'.join(
+        ' '.join(line.get_text().strip() for line in sorted(row, key=lambda line: line.x0))
+        for row in rows
+    ), ruled
+
+def _layout_lines(container):
+    for obj in container:
+        if isinstance(obj, LTTextLine):
+            yield obj
+        elif isinstance(obj, LTContainer):
+            yield from _layout_lines(obj)
+
+def _extract_page(page, page_num):
+    """Extract one pdfplumber page: digital text and tables, or OCR as a fallback."""
+    page_content = _page_header(page_num)
+    text = None
     
-    # Clean up whitespace
-    text = re.sub(r'[ \t]+', ' ', text)  # Multiple spaces/tabs to single space
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)  # Multiple newlines to double
-    text = re.sub(r'^\s+|\s+$', '', text, flags=re.MULTILINE)  # Trim line starts/ends
+    # Step 1: Try to extract digital text with a timeout
+    try:
+        try:
+            text, ruled = extract_with_timeout(_pdfplumber_text, 15, page)
+        except TimeoutError:
+            logging.warning(f"Page {page_num}: Text extraction timed out")
+            text, ruled = None, False
+        
+        if not _needs_ocr(page, text):
+            logging.info(f"Page {page_num}: Digital text extraction successful")
+            page_content.append("==DIGITAL TEXT EXTRACTION==")
+            page_content.append(clean_text_for_api(text))
+            
+            # Also try to extract tables if present; cells are only extracted
+            # for tables that detection actually found, and detection only
+            # runs on pages with the ruling lines it looks for
+            try:
+                if EXTRACT_TABLES and ruled:
+                    found = page.find_tables()
+                    if found:
+                        _append_tables(page_content, [table.extract() for table in found])
+            except Exception as e:
+                logging.warning(f"Table extraction failed for page {page_num}: {str(e)}")
+        
+        else:
+            # Text extraction failed or returned too little, use OCR
+            raise ValueError("Insufficient text extracted")
+            
+    except (TimeoutError, ValueError, Exception) as e:
+        # Step 2: Fall back to OCR. Font sizes come from the parsed page, so
+        # when parsing timed out or failed the page is not parsed again (with
+        # no time limit, while the abandoned parse may still be running)
+        _append_ocr(page_content, page_num, lambda: _render_pdfplumber(
+            page, OCR_DPI if text is None else _ocr_resolution(page)
+        ))
     
-    return text.strip()
+    return '\n'.join(page_content)
+
+def _page_header(page_num):
+    return [f"\n{'='*50}", f"PAGE {page_num}", f"{'='*50}\n"]
+
+def _render_pdfplumber(page, resolution):
+    """
+    Render a pdfplumber page for OCR at resolution DPI. This is what
+    page.to_image does, but PDFium renders straight to grayscale, the
+    1 byte/pixel tesseract works on, rather than to BGRX that is then
+    converted to RGB and then to gray.
+    """
+    document = pypdfium2.PdfDocument(page.pdf.path or page.pdf.stream, password=page.pdf.password)
+    try:
+        bitmap = document[page.page_number - 1].render(scale=resolution / 72, grayscale=True)
+        return bitmap.to_pil()
+    finally:
+        document.close()
+
+def _render_pymupdf(page):
+    """Render a PyMuPDF page for OCR, directly in grayscale."""
+    pixmap = page.get_pixmap(dpi=OCR_DPI, colorspace=pymupdf.csGRAY, alpha=False)
+    return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+
+def _append_ocr(page_content, page_num, render):
+    """Append the OCR section for a page; render() returns it as a grayscale image."""
+    logging.info(f"Page {page_num}: Falling back to OCR extraction")
+    page_content.append(f"==START OF OCR FOR PAGE {page_num}==")
+    
+    try:
+        img = render()
+        
+        # Perform OCR with timeout protection; the image is freed as soon as
+        # OCR is done rather than when the page is released
+        try:
+            ocr_text = _ocr_image(img, 30)
+        finally:
+            img.close()
+        if ocr_text is None:
+            logging.warning(f"OCR timed out for page {page_num}")
+        
+        # Clean OCR text immediately and aggressively
+        if ocr_text:
+            # Clean immediately to avoid Unicode propagation; the result is
+            # already printable ASCII plus newlines
+            ocr_text = clean_text_for_api(ocr_text)
+            if ocr_text.strip():
+                page_content.append(ocr_text)
+            else:
+                page_content.append("[OCR PRODUCED NO READABLE TEXT]")
+        else:
+            page_content.append("[OCR TIMED OUT FOR THIS PAGE]")
+            
+    except Exception as ocr_error:
+        # Clean error messages too, so every page comes out already clean
+        error_msg = clean_text_for_api(str(ocr_error))
+        logging.error(f"OCR failed for page {page_num}: {error_msg}")
+        page_content.append(f"[OCR FAILED: {error_msg}]")
+    
+    page_content.append(f"==END OF OCR FOR PAGE {page_num}==")
+
+def _extract_one_page(args):
+    """Process-pool entry point: pdfplumber pages can't be pickled, so reopen the file."""
+    pdf_path, page_index = args
+    # Only build the one Page object; pdf.pages otherwise sets up every page
+    # of the document on each reopen
+    with pdfplumber.open(pdf_path, pages=[page_index + 1]) as pdf:
+        return _extract_page(pdf.pages[0], page_index + 1)
+
+def _pymupdf_page_text(page, page_num, text):
+    """Format one PyMuPDF page that has enough digital text, with its tables."""
+    logging.info(f"Page {page_num}: Digital text extraction successful")
+    page_content = _page_header(page_num)
+    page_content.append("==DIGITAL TEXT EXTRACTION==")
+    page_content.append(clean_text_for_api(text))
+    try:
+        # find_tables needs PyMuPDF 1.23+
+        if EXTRACT_TABLES and hasattr(page, "find_tables"):
+            _append_tables(page_content, [table.extract() for table in page.find_tables().tables])
+    except Exception as e:
+        logging.warning(f"Table extraction failed for page {page_num}: {str(e)}")
+    return '\n'.join(page_content)
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def _ocr_pymupdf_page(page, page_num):
+    """OCR one PyMuPDF page that has too little digital text."""
+    page_content = _page_header(page_num)
+    _append_ocr(page_content, page_num, lambda: _render_pymupdf(page))
+    return '\n'.join(page_content)
+
+def _ocr_one_page_pymupdf(args):
+    """Process-pool entry point: PyMuPDF pages can't be pickled, so reopen the file."""
+    pdf_path, page_index = args
+    with pymupdf.open(pdf_path) as doc:
+        return _ocr_pymupdf_page(doc[page_index], page_index + 1)
+
+def _iter_pages_pymupdf(doc, pdf_path):
+    """
+    Extract pages with PyMuPDF (MuPDF, C) instead of pdfminer. Pages without
+    enough digital text are rendered by MuPDF and OCR'd, on the page pool
+    when there are several, so their tesseract runs overlap.
+    """
+    executor = None
+    # Pages not yet yielded, in order: finished text, or OCR still running in
+    # the pool. A page is yielded once every page before it is done.
+    pending = deque()
+    try:
+        with doc:
+            logging.info(f"Processing {doc.page_count} pages with PyMuPDF...")
+            workers = min(PDF_WORKERS, doc.page_count)
+            for page_num, page in enumerate(doc, 1):
+                text = page.get_text("text")
+                if not _needs_ocr(page, text):
+                    pending.append(_pymupdf_page_text(page, page_num, text))
+                # The digital/scanned decision is made here, once: OCR pages are
+                # rendered by MuPDF rather than reparsed by pdfplumber first
+                elif workers <= 1:
+                    pending.append(_ocr_pymupdf_page(page, page_num))
+                else:
+                    if executor is None:
+                        executor = _page_pool()
+                    pending.append(executor.submit(_ocr_one_page_pymupdf, (pdf_path, page_num - 1)))
+                
+                while pending and (isinstance(pending[0], str) or pending[0].done()):
+                    item = pending.popleft()
+                    yield item if isinstance(item, str) else item.result()
+        
+        while pending:
+            item = pending.popleft()
+            yield item if isinstance(item, str) else item.result()
+    except BrokenProcessPool:
+        _discard_page_pool(executor)
+        raise
+    finally:
+        # The pool is shared, so only this document's remaining pages are dropped
+        for item in pending:
+            if not isinstance(item, str):
+                item.cancel()
+
+def iter_page_texts(pdf_path):
+    """
+    Yield the extracted text of each page, in order, as soon as it is ready,
+    for consumers that can work incrementally. Uses the configured backend and
+    the page process pool like extract_text_from_pdf.
+    """
+    if PDF_BACKEND == 'pymupdf' and pymupdf is not None:
+        try:
+            doc = pymupdf.open(pdf_path)
+        except Exception as e:
+            logging.warning(f"PyMuPDF could not open {pdf_path}, using pdfplumber: {str(e)}")
+        else:
+            yield from _iter_pages_pymupdf(doc, pdf_path)
+            return
+    
+    with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
+        logging.info(f"Processing {total_pages} pages...")
+        
+        workers = min(PDF_WORKERS, total_pages)
+        if workers <= 1 or total_pages < PDF_POOL_MIN_PAGES:
+            for page_num, page in enumerate(pdf.pages, 1):
+                try:
+                    yield _extract_page(page, page_num)
+                finally:
+                    # pdf.pages keeps every Page alive; drop each one's parsed
+                    # objects once it is done so memory stays flat over long PDFs
+                    page.close()
+            return
+    
+    # Page parsing is pure-Python and CPU-bound, so it needs processes, not threads.
+    # Pages go out in small batches to cut per-task IPC on long documents.
+    # Closing this generator early cancels the pages still queued.
+    chunksize = max(1, total_pages // (workers * 4))
+    executor = _page_pool()
+    try:
+        yield from executor.map(
+            _extract_one_page, [(pdf_path, i) for i in range(total_pages)], chunksize=chunksize
+        )
+    except BrokenProcessPool:
+        _discard_page_pool(executor)
+        raise
+
+# Extracted text of recently processed files, keyed on file content and the
+# settings that affect the output, so a resubmitted PDF is not parsed again.
+# Results are also written to EXTRACT_CACHE_DIR, which survives restarts and
+# is shared by all workers; delete a file there to invalidate it.
+EXTRACT_CACHE_SIZE = int(os.environ.get("EXTRACT_CACHE_SIZE", "64"))
+EXTRACT_CACHE_DIR = os.environ.get("EXTRACT_CACHE_DIR", "cache")
+_EXTRACT_CACHE = OrderedDict()
+# Part of every cache key. Bump whenever extraction, cleaning or compression
+# changes the text produced for the same file, so entries written by older
+# code (which survive restarts and deploys on disk) stop matching.
+EXTRACT_CACHE_VERSION = 2
+# Documents are extracted from several threads at once
+_EXTRACT_CACHE_LOCK = threading.Lock()
+
+def content_digest():
+    """Hash object behind file_content_hash, for hashing a file while writing it."""
+    return hashlib.blake2b(digest_size=16)
+
+def file_content_hash(pdf_path):
+    """Digest of a file's content, as extract_text_from_pdf keys its cache."""
+    digest = content_digest()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cached_extraction(content_hash):
+    """extract_text_from_pdf's cached result for a file content hash, or None."""
+    if not (EXTRACT_CACHE_SIZE > 0 or EXTRACT_CACHE_DIR):
+        return None
+    return _extract_cache_get(_extract_cache_key(content_hash))
+
+def _extract_cache_key(content_hash):
+    backend = PDF_BACKEND if pymupdf is not None else 'pdfplumber'
+    settings = (f"{EXTRACT_CACHE_VERSION}\0{content_hash}\0{backend}\0{EXTRACT_TABLES}\0"
+                f"{COMPRESS_EXTRACTED}\0{OCR_DPI}\0{TESSDATA_DIR}")
+    return hashlib.blake2b(settings.encode(), digest_size=16).hexdigest()
+
+def _extract_cache_path(key):
+    return os.path.join(EXTRACT_CACHE_DIR, f"{key}.txt")
+
+def _extract_cache_get(key):
+    with _EXTRACT_CACHE_LOCK:
+        result = _EXTRACT_CACHE.get(key)
+        if result is not None:
+            _EXTRACT_CACHE.move_to_end(key)
+            return result
+    if not EXTRACT_CACHE_DIR:
+        return None
+    try:
+        with open(_extract_cache_path(key), encoding='utf-8') as f:
+            result = f.read()
+    except OSError:
+        return None
+    _extract_cache_put(key, result, persist=False)
+    return result
+
+def _extract_cache_put(key, result, persist=True):
+    if EXTRACT_CACHE_SIZE > 0:
+        with _EXTRACT_CACHE_LOCK:
+            _EXTRACT_CACHE[key] = result
+            _EXTRACT_CACHE.move_to_end(key)
+            while len(_EXTRACT_CACHE) > EXTRACT_CACHE_SIZE:
+                _EXTRACT_CACHE.popitem(last=False)
+    if persist and EXTRACT_CACHE_DIR:
+        # Written under a unique name and renamed into place, so a concurrent
+        # reader never sees a partial file
+        path = _extract_cache_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(EXTRACT_CACHE_DIR, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(result)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write extraction cache file {path}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+def extract_text_from_pdf(pdf_path: str, content_hash=None) -> str:
     """
     Extract text from PDF using a multi-step approach:
     1. Try digital text extraction first (for text-based PDFs)
     2. Use OCR for pages where text extraction fails (for scanned PDFs)
     3. Extract and structure tables separately
     4. Maintain document structure and layout
+    Long documents are processed on a shared pool of PDF_WORKERS processes.
+    When PyMuPDF is installed, digital text and tables come from MuPDF, which
+    is much faster than pdfminer; PDF_BACKEND=pdfplumber turns this off.
+    Results of complete extractions are cached by file content, in memory
+    and in EXTRACT_CACHE_DIR. Callers that already hashed the file with
+    file_content_hash can pass content_hash to skip reading it again.
     """
     
     extracted_content = []
@@ -134,137 +842,16 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     logging.info(f"Starting PDF processing for: {pdf_path}")
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            total_pages = len(pdf.pages)
-            logging.info(f"Processing {total_pages} pages...")
-            
-            for page_num, page in enumerate(pdf.pages, 1):
-                page_content = []
-                page_content.append(f"\n{'='*50}")
-                page_content.append(f"PAGE {page_num}")
-                page_content.append(f"{'='*50}\n")
-                
-                # Step 1: Try to extract digital text with cross-platform timeout
-                try:
-                    text = None
-                    
-                    # Cross-platform timeout handling
-                    if platform.system() != 'Windows':
-                        # Unix-like systems - use signal
-                        try:
-                            def timeout_handler(signum, frame):
-                                raise TimeoutError("Text extraction timed out")
-                            
-                            signal.signal(signal.SIGALRM, timeout_handler)
-                            signal.alarm(15)  # 15 second timeout
-                            
-                            # Use layout=False to avoid Unicode box-drawing characters
-                            text = page.extract_text(layout=False)
-                            signal.alarm(0)
-                        except TimeoutError:
-                            signal.alarm(0)
-                            logging.warning(f"Page {page_num}: Text extraction timed out")
-                            text = None
-                    else:
-                        # Windows or fallback - use threading
-                        try:
-                            text = extract_with_timeout(page.extract_text, 15, layout=False)
-                        except TimeoutError:
-                            logging.warning(f"Page {page_num}: Text extraction timed out")
-                            text = None
-                    
-                    if text and len(text.strip()) > 50:
-                        logging.info(f"Page {page_num}: Digital text extraction successful")
-                        page_content.append("==DIGITAL TEXT EXTRACTION==")
-                        page_content.append(clean_text_for_api(text))
-                        
-                        # Also try to extract tables if present
-                        try:
-                            tables = page.extract_tables()
-                            if tables:
-                                page_content.append("\n==TABLES FOUND==")
-                                for idx, table in enumerate(tables, 1):
-                                    if table and len(table) > 0:
-                                        page_content.append(f"\nTable {idx}:")
-                                        for row in table:
-                                            if row:
-                                                cleaned_row = []
-                                                for cell in row:
-                                                    cleaned_row.append(clean_text_for_api(str(cell) if cell else ""))
-                                                page_content.append(" | ".join(cleaned_row))
-                        except Exception as e:
-                            logging.warning(f"Table extraction failed for page {page_num}: {str(e)}")
-                    
-                    else:
-                        # Text extraction failed or returned too little, use OCR
-                        raise ValueError("Insufficient text extracted")
-                        
-                except (TimeoutError, ValueError, Exception) as e:
-                    # Step 2: Fall back to OCR
-                    logging.info(f"Page {page_num}: Falling back to OCR extraction")
-                    page_content.append(f"==START OF OCR FOR PAGE {page_num}==")
-                    
-                    try:
-                        # Convert page to image for OCR
-                        pil_image = page.to_image(resolution=200)
-                        img = pil_image.original
-                        
-                        # Perform OCR with cross-platform timeout protection
-                        ocr_text = None
-                        
-                        if platform.system() != 'Windows':
-                            # Unix-like systems - use signal
-                            try:
-                                def timeout_handler(signum, frame):
-                                    raise TimeoutError("OCR timed out")
-                                
-                                signal.signal(signal.SIGALRM, timeout_handler)
-                                signal.alarm(30)  # 30 second timeout for OCR
-                                
-                                # OCR with better configuration for text preservation
-                                custom_config = r'--oem 3 --psm 6 -c preserve_interword_spaces=0'
-                                ocr_text = pytesseract.image_to_string(img, lang='eng', config=custom_config)
-                                signal.alarm(0)
-                                
-                            except TimeoutError:
-                                signal.alarm(0)
-                                logging.warning(f"OCR timed out for page {page_num}")
-                                ocr_text = None
-                        else:
-                            # Windows or fallback - use threading
-                            try:
-                                def perform_ocr():
-                                    custom_config = r'--oem 3 --psm 6 -c preserve_interword_spaces=0'
-                                    return pytesseract.image_to_string(img, lang='eng', config=custom_config)
-                                
-                                ocr_text = extract_with_timeout(perform_ocr, 30)
-                            except TimeoutError:
-                                logging.warning(f"OCR timed out for page {page_num}")
-                                ocr_text = None
-                        
-                        # Clean OCR text immediately and aggressively
-                        if ocr_text:
-                            # Clean immediately to avoid Unicode propagation
-                            ocr_text = clean_text_for_api(ocr_text)
-                            # Additional OCR-specific cleaning
-                            ocr_text = re.sub(r'[^\x20-\x7E\n\r\t]', '', ocr_text)  # Keep only printable ASCII
-                            if ocr_text.strip():
-                                page_content.append(ocr_text)
-                            else:
-                                page_content.append("[OCR PRODUCED NO READABLE TEXT]")
-                        else:
-                            page_content.append("[OCR TIMED OUT FOR THIS PAGE]")
-                            
-                    except Exception as ocr_error:
-                        # Clean error messages too!
-                        error_msg = str(ocr_error)
-                        error_msg = error_msg.encode('ascii', errors='ignore').decode('ascii')
-                        logging.error(f"OCR failed for page {page_num}: {error_msg}")
-                        page_content.append(f"[OCR FAILED: {error_msg}]")
-                    
-                    page_content.append(f"==END OF OCR FOR PAGE {page_num}==")
-                
-                extracted_content.append('\n'.join(page_content))
+        cache_key = None
+        if EXTRACT_CACHE_SIZE > 0 or EXTRACT_CACHE_DIR:
+            cache_key = _extract_cache_key(content_hash or file_content_hash(pdf_path))
+        cached = _extract_cache_get(cache_key) if cache_key else None
+        if cached is not None:
+            logging.info(f"Using cached extraction for identical file ({len(cached)} characters)")
+            return cached
+        
+        # Pages are appended as they arrive, so a failure keeps the earlier ones
+        extracted_content.extend(iter_page_texts(pdf_path))
                 
         # Combine all content
         final_content = []
@@ -277,20 +864,33 @@ def extract_text_from_pdf(pdf_path: str) -> str:
         # Add main content
         final_content.extend(extracted_content)
         
-        # Final cleanup
+        # Pages were cleaned as they were built and the header is plain ASCII,
+        # so only whitespace around the page joins needs tidying. The page
+        # strings are dropped once joined, and the partial-result fallback
+        # keeps only the latest full copy, so at most two copies of the
+        # document are alive at any point.
         result = '\n'.join(final_content)
-        result = clean_text_for_api(result)
+        del final_content
+        extracted_content[:] = [result]
+        result = _whitespace_cleanup(result)
+        extracted_content[:] = [result]
         
-        # No truncation - send full content to API
+        # No truncation - send full content to API, minus markup and repeated boilerplate
         logging.info(f"Full content extracted: {len(result)} characters")
+        if COMPRESS_EXTRACTED:
+            compressed = compress_extracted(result)
+            logging.info(f"Compressed extracted text: {len(result)} -> {len(compressed)} characters")
+            result = compressed
         
         logging.info(f"PDF processing complete. Extracted {len(result)} characters.")
+        if cache_key:
+            _extract_cache_put(cache_key, result)
         return result
         
     except Exception as e:
         logging.error(f"Critical error in PDF processing: {str(e)}")
         # Return whatever we managed to extract
         if extracted_content:
-            return clean_text_for_api('\n'.join(extracted_content))
+            return _whitespace_cleanup('\n'.join(extracted_content))
         else:
             return f"[PDF EXTRACTION FAILED: {str(e)}]"
\ No newline at end of file
@@ -1,15 +1,28 @@
 import os
+import re
+import json
+import hashlib
 import logging
-from flask import render_template, request, flash, redirect, url_for, jsonify, make_response, session
+import threading
+import time
+import shutil
+from flask import render_template, request, flash, redirect, url_for, jsonify, session, Response, stream_with_context, send_file
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import undefer
 from flask_login import current_user
 from app import app, db
-from models import ComplianceReview
-from pdf_processor import extract_text_from_pdf
-from compliance_analyzer import analyze_compliance
+from models import ComplianceReview, ReportCache
+from pdf_processor import extract_text_from_pdf, content_digest, cached_extraction
+from compliance_analyzer import (
+    analyze_compliance, analyze_compliance_stream, build_batch_request, submit_batch, fetch_batch_results,
+    SEMANTIC_CACHE_THRESHOLD, embed_texts, cosine_similarity, report_cache_key,
+    STRUCTURED_OUTPUT, analyze_compliance_structured, render_report_markdown, report_summary,
+)
 from pdf_generator import generate_compliance_pdf
 from replit_auth import require_login, make_replit_blueprint
 import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 # Register authentication blueprint
 app.register_blueprint(make_replit_blueprint(), url_prefix="/auth")
@@ -21,9 +34,146 @@ def make_session_permanent():
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
+# Report PDFs are rendered off the request thread once a review completes
+_pdf_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='report-pdf')
+
+# Uploaded reviews are extracted and analyzed off the request thread. Analysis
+# mostly waits on the API and extraction runs its own process pool, so threads
+# are enough; REVIEW_WORKERS caps concurrent reviews per server process.
+REVIEW_WORKERS = int(os.environ.get("REVIEW_WORKERS", "4"))
+_review_executor = ThreadPoolExecutor(max_workers=REVIEW_WORKERS, thread_name_prefix='review')
+
+# Background jobs live only in their server process, so a review whose worker
+# was restarted or killed would stay pending forever. Reviews pending longer
+# than this (well past the 20 minute analysis budget) are marked failed when
+# next viewed; batch reviews wait on the Batch API instead and are exempt.
+STALE_REVIEW_SECONDS = int(os.environ.get("STALE_REVIEW_SECONDS", "3600"))
+STALE_REVIEW_MESSAGE = 'The analysis was interrupted before it finished. Please upload the documents again.'
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Replace common Unicode characters that might slip through, in one
+# str.translate pass
+_AI_OUTPUT_TABLE = str.maketrans({
+    '\u2011': '-',  # non-breaking hyphen
+    '\u2013': '-',  # en dash
+    '\u2014': '--', # em dash
+    '\u2019': "'",  # right single quote
+    '\u2018': "'",  # left single quote
+    '\u201c': '"',  # left double quote
+    '\u201d': '"',  # right double quote
+    '\u2026': '...',# ellipsis
+    '\u00b0': ' deg', # degree
+    '\u00a0': ' ',  # non-breaking space
+    '\u2032': "'",  # prime
+    '\u2033': '"',  # double prime
+})
+
+# Clean the AI response output to remove any remaining Unicode characters
+def clean_ai_output(text):
+    if not text:
+        return ""
+    if text.isascii():
+        return text
+
+    text = text.translate(_AI_OUTPUT_TABLE)
+
+    # Convert to ASCII, ignoring any remaining problematic characters
+    return text.encode('ascii', errors='ignore').decode('ascii')
+
+# Report summary lines: the label, then the rest of its line
+_SUMMARY_LINE_RE = re.compile(
+    r'(Overall compliance status|Number of models reviewed|Number of compliant models identified)([^\n]*)'
+)
+_SUMMARY_FIELDS = {
+    'Overall compliance status': 'overall_status',
+    'Number of models reviewed': 'models_reviewed',
+    'Number of compliant models identified': 'compliant_models',
+}
+_INT_RE = re.compile(r'\d+')
+
+def _save_report(review, analysis_result, cache_key=None):
+    """
+    Store the cleaned report on the review and parse its summary fields.
+    With cache_key, the report is also written through to the report cache.
+    """
+    # Clean the analysis result before saving
+    cleaned_analysis_result = clean_ai_output(analysis_result)
+    # Chunked and per-model reports inline failed parts as "Error analyzing ..."; don't persist those
+    if cache_key is not None and 'Error analyzing' not in cleaned_analysis_result:
+        db.session.merge(ReportCache(hash=cache_key, report_content=cleaned_analysis_result))
+
+    # Update database record with results
+    review.report_content = cleaned_analysis_result
+    review.status = 'completed'
+
+    logging.info(f"Saving report for review {review.id}: {len(cleaned_analysis_result or '')} characters "
+                 f"({len(analysis_result or '')} before cleaning)")
+
+    # Try to extract summary data (basic parsing); a later line overrides an earlier one
+    for match in _SUMMARY_LINE_RE.finditer(cleaned_analysis_result or ''):
+        field = _SUMMARY_FIELDS[match.group(1)]
+        value = match.group(2).rsplit(':', 1)[-1]
+        if field == 'overall_status':
+            review.overall_status = value.strip().strip('*[]')
+        else:
+            digits = ''.join(_INT_RE.findall(value))
+            if digits:
+                setattr(review, field, int(digits))
+
+    _queue_report_pdf(review)
+
+def _expire_stale_review(review):
+    """Mark a pending review failed if its background job can no longer be running."""
+    if review.status != 'pending' or review.batch_id is not None:
+        return
+    if review.created_at is None or review.created_at > datetime.utcnow() - timedelta(seconds=STALE_REVIEW_SECONDS):
+        return
+    logging.warning(f"Review {review.id} has been pending since {review.created_at}; marking it as interrupted")
+    review.status = 'error'
+    review.error_message = STALE_REVIEW_MESSAGE
+    db.session.commit()
+
+def _review_pdf_data(review):
+    """Review metadata shown in the PDF header table."""
+    return {
+        'id': review.id,
+        'created_at': review.created_at.strftime('%Y-%m-%d %H:%M:%S UTC') if review.created_at else 'N/A',
+        'project_spec_filename': review.project_spec_filename or 'N/A',
+        'submittal_filename': review.submittal_filename or 'N/A',
+        'overall_status': review.overall_status or 'N/A',
+        'models_reviewed': review.models_reviewed,
+        'compliant_models': review.compliant_models
+    }
+
+def _report_pdf_path(review):
+    """On-disk location of a review's PDF; the content hash keeps stale files from matching."""
+    digest = hashlib.sha256(review.report_content.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(app.config['REPORT_FOLDER'], f"compliance_report_{review.id}_{digest}.pdf")
+
+def _write_report_pdf(path, report_content, review_data):
+    """Render the PDF and store it atomically at path."""
+    pdf_content = generate_compliance_pdf(report_content, review_data)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf_content)
+    os.replace(tmp_path, path)
+
+# Browser cache lifetime for downloaded report PDFs
+REPORT_MAX_AGE = 365 * 24 * 3600
+
+def _log_pdf_error(future):
+    if future.exception() is not None:
+        logging.error(f"Background PDF generation error: {str(future.exception())}")
+
+def _queue_report_pdf(review):
+    """Build the review's PDF in the background so downloads are served from disk."""
+    future = _pdf_executor.submit(
+        _write_report_pdf, _report_pdf_path(review), review.report_content, _review_pdf_data(review)
+    )
+    future.add_done_callback(_log_pdf_error)
+
 @app.route('/')
 def index():
     """Main page with file upload form or login landing"""
@@ -36,10 +186,6 @@ def index():
 @require_login
 def upload_files():
     """Handle file upload and initiate compliance analysis"""
-    # Set a longer timeout for this specific route
-    from flask import g
-    g.request_timeout = 1200  # 20 minutes
-    
     try:
         # Check if files were uploaded
         if 'project_spec' not in request.files or 'vendor_submittal' not in request.files:
@@ -66,8 +212,12 @@ def upload_files():
         project_spec_path = os.path.join(app.config['UPLOAD_FOLDER'], project_spec_filename)
         vendor_submittal_path = os.path.join(app.config['UPLOAD_FOLDER'], vendor_submittal_filename)
         
-        project_spec_file.save(project_spec_path)
-        vendor_submittal_file.save(vendor_submittal_path)
+        (spec_hash, spec_text), (submittal_hash, submittal_text) = (
+            _save_upload(project_spec_file, project_spec_path),
+            _save_upload(vendor_submittal_file, vendor_submittal_path),
+        )
+        content_hashes = (spec_hash, submittal_hash)
+        texts = (spec_text, submittal_text)
         
         # Create database record
         review = ComplianceReview()
@@ -78,160 +228,301 @@ def upload_files():
         db.session.add(review)
         db.session.commit()
         
-        try:
-            # Extract text from PDFs
-            logging.info("Extracting text from Project Specification...")
-            project_spec_text = extract_text_from_pdf(project_spec_path)
-            
-            logging.info("Extracting text from Vendor Submittal...")
-            vendor_submittal_text = extract_text_from_pdf(vendor_submittal_path)
-            
-            if not project_spec_text.strip():
-                raise ValueError("Could not extract text from Project Specification PDF")
-            
-            if not vendor_submittal_text.strip():
-                raise ValueError("Could not extract text from Vendor Submittal PDF")
-            
-            logging.info("Starting compliance analysis...")
-            # Perform compliance analysis
-            analysis_result = analyze_compliance(project_spec_text, vendor_submittal_text)
-            
-            # Clean the AI response output to remove any remaining Unicode characters
-            def clean_ai_output(text):
-                if not text:
-                    return ""
-                
-                # Replace common Unicode characters that might slip through
-                replacements = {
-                    '\u2011': '-',  # non-breaking hyphen
-                    '\u2013': '-',  # en dash
-                    '\u2014': '--', # em dash
-                    '\u2019': "'",  # right single quote
-                    '\u2018': "'",  # left single quote
-                    '\u201c': '"',  # left double quote
-                    '\u201d': '"',  # right double quote
-                    '\u2026': '...',# ellipsis
-                    '\u00b0': ' deg', # degree
-                    '\u00a0': ' ',  # non-breaking space
-                    '\u2032': "'",  # prime
-                    '\u2033': '"',  # double prime
-                }
-                
-                for old, new in replacements.items():
-                    text = text.replace(old, new)
-                
-                # Convert to ASCII, ignoring any remaining problematic characters
-                try:
-                    text = text.encode('ascii', errors='ignore').decode('ascii')
-                except:
-                    # Fallback: manually strip non-ASCII characters
-                    text = ''.join(ch for ch in text if ord(ch) < 128)
-                
-                return text
-            
-            # Clean the analysis result before saving
-            cleaned_analysis_result = clean_ai_output(analysis_result)
-            
-            # Update database record with results
-            review.report_content = cleaned_analysis_result
-            review.status = 'completed'
-            
-            # Debug: Show what we're saving to database
-            logging.info("=" * 80)
-            logging.info("SAVING TO DATABASE:")
-            logging.info(f"Review ID: {review.id}")
-            logging.info(f"Status: {review.status}")
-            logging.info(f"Original report length: {len(analysis_result) if analysis_result else 0}")
-            logging.info(f"Cleaned report length: {len(cleaned_analysis_result) if cleaned_analysis_result else 0}")
-            logging.info(f"Report content first 500 chars: {cleaned_analysis_result[:500] if cleaned_analysis_result else 'None'}")
-            logging.info("=" * 80)
-            
-            # Try to extract summary data (basic parsing)
-            lines = cleaned_analysis_result.split('\n') if cleaned_analysis_result else []
-            for line in lines:
-                if 'Overall compliance status' in line:
-                    review.overall_status = line.split(':')[-1].strip().strip('*[]')
-                elif 'Number of models reviewed' in line:
-                    try:
-                        review.models_reviewed = int(''.join(filter(str.isdigit, line.split(':')[-1])))
-                    except:
-                        pass
-                elif 'Number of compliant models identified' in line:
-                    try:
-                        review.compliant_models = int(''.join(filter(str.isdigit, line.split(':')[-1])))
-                    except:
-                        pass
-            
-            db.session.commit()
-            
-            # Debug: Verify what was actually saved
-            logging.info("=" * 80)
-            logging.info("VERIFICATION AFTER DATABASE COMMIT:")
-            fresh_review = ComplianceReview.query.get(review.id)
-            if fresh_review:
-                logging.info(f"Fresh review status: {fresh_review.status}")
-                logging.info(f"Fresh review report content length: {len(fresh_review.report_content) if fresh_review.report_content else 0}")
-                logging.info(f"Fresh review overall status: {fresh_review.overall_status}")
-            else:
-                logging.error("Could not retrieve fresh review from database!")
-            logging.info("=" * 80)
-            
-            flash('Compliance analysis completed successfully!', 'success')
-            return redirect(url_for('view_results', review_id=review.id))
-            
-        except Exception as e:
-            logging.error(f"Error during analysis: {str(e)}")
-            # Rollback the transaction to clear any previous errors
-            db.session.rollback()
-            review.status = 'error'
-            review.error_message = str(e)
-            db.session.commit()
-            flash(f'Error during analysis: {str(e)}', 'error')
-            return redirect(url_for('index'))
+        # Re-running the same submittal lets the analyzer send only what changed
+        session_key = f"{current_user.id}:{vendor_submittal_file.filename}"
+        batch = bool(request.form.get('batch'))
         
-        finally:
-            # Clean up uploaded files
+        if request.args.get('stream') == '1':
+            # Streaming keeps the request open to relay the report as it is
+            # written, so this path runs on the request thread. Only clients
+            # that ask for it take it; the upload form uses the background job.
             try:
-                os.remove(project_spec_path)
-                os.remove(vendor_submittal_path)
-            except:
-                pass
+                outcome = _process_review(review, project_spec_path, vendor_submittal_path, session_key,
+                                          batch=batch, stream=True, content_hashes=content_hashes, texts=texts)
+            except Exception as e:
+                _fail_review(review, e)
+                flash(f'Error during analysis: {str(e)}', 'error')
+                return redirect(url_for('index'))
+            finally:
+                # The text is already extracted, so the uploads can be removed
+                # while the report streams back to the browser
+                _remove_uploads(project_spec_path, vendor_submittal_path)
+            if isinstance(outcome, Response):
+                return outcome
+            flash(*outcome)
+            return redirect(url_for('view_history') if batch else url_for('view_results', review_id=review.id))
+        
+        # Everything else runs in the background; the results page polls until done
+        future = _review_executor.submit(
+            _review_job, review.id, project_spec_path, vendor_submittal_path, session_key, batch,
+            content_hashes, texts
+        )
+        future.add_done_callback(_log_review_error)
+        if batch:
+            flash('Analysis queued. Results will appear in your history within 24 hours.', 'info')
+            return redirect(url_for('view_history'))
+        flash('Analysis started. This page will update when the report is ready.', 'info')
+        return redirect(url_for('view_results', review_id=review.id))
                 
     except Exception as e:
         logging.error(f"Upload error: {str(e)}")
         flash(f'Upload error: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def _save_upload(file, path):
+    """
+    Hash an uploaded file and save it to path unless its extracted text is
+    already cached, in which case the file is never written. Returns the
+    content hash and the cached text, or None if the file was saved.
+    """
+    digest = content_digest()
+    for block in iter(lambda: file.stream.read(1 << 20), b''):
+        digest.update(block)
+    content_hash = digest.hexdigest()
+    # Held from here on, so an eviction before the review runs can't lose it
+    text = cached_extraction(content_hash)
+    if text is None:
+        file.stream.seek(0)
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(file.stream, out, 1 << 20)
+    return content_hash, text
+
+def _remove_uploads(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _fail_review(review, error):
+    """Record an analysis failure on the review."""
+    logging.error(f"Error during analysis: {str(error)}")
+    # Rollback the transaction to clear any previous errors
+    db.session.rollback()
+    review.status = 'error'
+    review.error_message = str(error)
+    db.session.commit()
+
+def _log_review_error(future):
+    if future.exception() is not None:
+        logging.error(f"Background review error: {str(future.exception())}")
+
+def _review_job(review_id, project_spec_path, vendor_submittal_path, session_key, batch, content_hashes, texts):
+    """Background entry point: process one uploaded review and remove its files."""
+    with app.app_context():
+        review = db.session.get(ComplianceReview, review_id)
+        if review.status != 'pending':
+            # Queued so long it was already reported as interrupted
+            _remove_uploads(project_spec_path, vendor_submittal_path)
+            return
+        try:
+            _process_review(review, project_spec_path, vendor_submittal_path, session_key,
+                            batch=batch, content_hashes=content_hashes, texts=texts)
+        except Exception as e:
+            _fail_review(review, e)
+        finally:
+            _remove_uploads(project_spec_path, vendor_submittal_path)
+
+def _process_review(review, project_spec_path, vendor_submittal_path, session_key, batch=False, stream=False,
+                    content_hashes=(None, None), texts=(None, None)):
+    """
+    Extract both PDFs and produce the review's report, from the report caches
+    when possible. Returns the (message, category) to flash to the user or,
+    with stream, the server-sent event response once the text is extracted.
+    content_hashes are the files' hashes when already known, and texts their
+    already-extracted text, in which case the file was never saved. Raises on
+    failure.
+    """
+    # End the current transaction so no pooled connection is held while the
+    # PDFs are extracted; the review reloads when it is next used
+    db.session.commit()
+    
+    # Extract text from both PDFs at once; OCR runs in tesseract processes and
+    # long documents in the page pool, so the two overlap despite the GIL
+    logging.info("Extracting text from Project Specification and Vendor Submittal...")
+    project_spec_text, vendor_submittal_text = texts
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='extract') as executor:
+        if vendor_submittal_text is None:
+            submittal_future = executor.submit(extract_text_from_pdf, vendor_submittal_path, content_hashes[1])
+        if project_spec_text is None:
+            project_spec_text = extract_text_from_pdf(project_spec_path, content_hashes[0])
+        if vendor_submittal_text is None:
+            vendor_submittal_text = submittal_future.result()
+    
+    if not project_spec_text.strip():
+        raise ValueError("Could not extract text from Project Specification PDF")
+    
+    if not vendor_submittal_text.strip():
+        raise ValueError("Could not extract text from Vendor Submittal PDF")
+    
+    # Exact repeats of an earlier upload reuse its report outright
+    cache_key = report_cache_key(project_spec_text, vendor_submittal_text)
+    cached = db.session.get(ReportCache, cache_key)
+    if cached is not None:
+        logging.info(f"Report cache hit for review {review.id}")
+        _save_report(review, cached.report_content)
+        db.session.commit()
+        return 'These documents were reviewed before; the earlier report has been reused.', 'success'
+    
+    if SEMANTIC_CACHE_THRESHOLD is not None and _reuse_similar_review(review, project_spec_text, vendor_submittal_text):
+        return 'A matching earlier review was found; its report has been reused.', 'success'
+    
+    if batch:
+        # Queued reviews run through the Batch API and are picked up by poll_batches
+        review.batch_id = submit_batch([build_batch_request(review.id, project_spec_text, vendor_submittal_text)])
+        db.session.commit()
+        return 'Analysis queued. Results will appear in your history within 24 hours.', 'info'
+    
+    logging.info("Starting compliance analysis...")
+    if STRUCTURED_OUTPUT:
+        # JSON report rendered to Markdown locally; not streamed, since
+        # partial JSON is not readable. None means it needs chunking.
+        report_data = analyze_compliance_structured(project_spec_text, vendor_submittal_text)
+        if report_data is not None:
+            review.overall_status, review.models_reviewed, review.compliant_models = report_summary(report_data)
+            _save_report(review, render_report_markdown(report_data), cache_key)
+            db.session.commit()
+            return 'Compliance analysis completed successfully!', 'success'
+    
+    if stream:
+        return _stream_review(review.id, project_spec_text, vendor_submittal_text, session_key, cache_key)
+    
+    # Perform compliance analysis
+    details = {}
+    analysis_result = analyze_compliance(
+        project_spec_text,
+        vendor_submittal_text,
+        session_key=session_key,
+        details=details,
+    )
+    
+    # A delta review revised an earlier report, so it is not cached as the
+    # report for these documents
+    _save_report(review, analysis_result, None if details.get('delta') else cache_key)
+    db.session.commit()
+    return 'Compliance analysis completed successfully!', 'success'
+
+# Past reviews compared against per upload by the semantic cache
+SEMANTIC_CACHE_SCAN_LIMIT = 500
+
+def _reuse_similar_review(review, project_spec_text, vendor_submittal_text):
+    """
+    Embed both documents onto the review and, if an earlier review by the same
+    user is similar enough, copy its report. Returns True on a cache hit.
+    """
+    try:
+        spec_embedding, submittal_embedding = embed_texts([project_spec_text, vendor_submittal_text])
+    except Exception as e:
+        logging.warning(f"Semantic cache lookup skipped: {str(e)}")
+        return False
+    review.spec_embedding = json.dumps(spec_embedding)
+    review.submittal_embedding = json.dumps(submittal_embedding)
+
+    candidates = ComplianceReview.query.options(
+        undefer(ComplianceReview.spec_embedding),
+        undefer(ComplianceReview.submittal_embedding),
+    ).filter(
+        ComplianceReview.user_id == review.user_id,
+        ComplianceReview.status == 'completed',
+        ComplianceReview.spec_embedding.isnot(None),
+        ComplianceReview.id != review.id,
+    ).order_by(ComplianceReview.created_at.desc()).limit(SEMANTIC_CACHE_SCAN_LIMIT)
+
+    best, best_score = None, 0.0
+    for candidate in candidates:
+        # Both documents must match; a similar submittal against a different spec is a new review
+        score = min(
+            cosine_similarity(spec_embedding, json.loads(candidate.spec_embedding)),
+            cosine_similarity(submittal_embedding, json.loads(candidate.submittal_embedding)),
+        )
+        if score > best_score:
+            best, best_score = candidate, score
+
+    cache_hit = best is not None and best_score >= SEMANTIC_CACHE_THRESHOLD
+    logging.info(f"Semantic cache {'hit' if cache_hit else 'miss'} for review {review.id} (best similarity {best_score:.4f})")
+    if not cache_hit:
+        db.session.commit()
+        return False
+
+    review.report_content = best.report_content
+    review.overall_status = best.overall_status
+    review.models_reviewed = best.models_reviewed
+    review.compliant_models = best.compliant_models
+    review.status = 'completed'
+    db.session.commit()
+    return True
+
+def _sse(event, data):
+    """Format one server-sent event; data is JSON-encoded so newlines survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_review(review_id, project_spec_text, vendor_submittal_text, session_key, cache_key=None):
+    """Stream the report as server-sent events and persist it once complete."""
+    def generate():
+        parts = []
+        completed = False
+        error = None
+        details = {}
+        try:
+            for piece in analyze_compliance_stream(project_spec_text, vendor_submittal_text,
+                                                   session_key=session_key, details=details):
+                parts.append(piece)
+                yield _sse('chunk', piece)
+            completed = True
+        except Exception as e:
+            logging.error(f"Error during analysis: {str(e)}")
+            error = e
+        finally:
+            # Runs on success, on failure and when the client disconnects
+            db.session.rollback()
+            review = ComplianceReview.query.get(review_id)
+            if completed:
+                _save_report(review, "".join(parts), None if details.get('delta') else cache_key)
+            else:
+                review.status = 'error'
+                review.error_message = str(error) if error else 'Analysis was interrupted before it completed'
+            db.session.commit()
+
+        if completed:
+            yield _sse('done', url_for('view_results', review_id=review_id))
+        else:
+            yield _sse('error', f'Error during analysis: {str(error)}')
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/results/<int:review_id>')
 @require_login
 def view_results(review_id):
     """Display compliance analysis results"""
     review = ComplianceReview.query.filter_by(id=review_id, user_id=current_user.id).first_or_404()
+    _expire_stale_review(review)
     
-    # Debug: Show what we're displaying
-    logging.info("=" * 80)
-    logging.info(f"DISPLAYING RESULTS FOR REVIEW {review_id}:")
-    logging.info(f"Status: {review.status}")
-    logging.info(f"Report content length: {len(review.report_content) if review.report_content else 0}")
-    logging.info(f"Overall status: {review.overall_status}")
-    logging.info(f"Models reviewed: {review.models_reviewed}")
-    logging.info(f"Compliant models: {review.compliant_models}")
-    if review.report_content:
-        logging.info(f"Report content first 500 chars: {review.report_content[:500]}")
-    else:
-        logging.info("NO REPORT CONTENT FOUND!")
-    logging.info("=" * 80)
+    logging.info(f"Displaying review {review_id}: status {review.status}, overall {review.overall_status}")
     
     if review.status == 'error':
         flash(f'Analysis failed: {review.error_message}', 'error')
         return redirect(url_for('index'))
     
     if review.status == 'pending':
-        flash('Analysis is still in progress. Please wait...', 'info')
-        return redirect(url_for('index'))
+        if review.batch_id:
+            flash('Analysis is still in progress. Please wait...', 'info')
+            return redirect(url_for('index'))
+        # Still running in the background; the page reloads until it finishes
+        return render_template('pending.html', review=review)
     
     return render_template('results.html', review=review)
 
+@app.route('/results/<int:review_id>/status')
+@require_login
+def review_status(review_id):
+    """Current status of a review, polled by the pending page."""
+    review = ComplianceReview.query.filter_by(id=review_id, user_id=current_user.id).first_or_404()
+    _expire_stale_review(review)
+    return jsonify({'status': review.status})
+
 @app.route('/download/<int:review_id>')
 @require_login
 def download_report(review_id):
@@ -243,25 +534,20 @@ def download_report(review_id):
         return redirect(url_for('index'))
     
     try:
-        # Prepare review data for PDF generation
-        review_data = {
-            'id': review.id,
-            'created_at': review.created_at.strftime('%Y-%m-%d %H:%M:%S UTC') if review.created_at else 'N/A',
-            'project_spec_filename': review.project_spec_filename or 'N/A',
-            'submittal_filename': review.submittal_filename or 'N/A',
-            'overall_status': review.overall_status or 'N/A',
-            'models_reviewed': review.models_reviewed,
-            'compliant_models': review.compliant_models
-        }
-        
-        # Generate PDF
-        pdf_content = generate_compliance_pdf(review.report_content, review_data)
-        
-        # Create response with PDF
-        response = make_response(pdf_content)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename=compliance_report_{review_id}.pdf'
-        
+        # Normally built in the background when the report was saved; build it
+        # now if that has not finished (or the report predates it). Either way
+        # the file is streamed from disk rather than buffered in the response.
+        pdf_path = _report_pdf_path(review)
+        if not os.path.exists(pdf_path):
+            _write_report_pdf(pdf_path, review.report_content, _review_pdf_data(review))
+        response = send_file(pdf_path, mimetype='application/pdf', as_attachment=True,
+                             download_name=f'compliance_report_{review_id}.pdf')
+        # A completed report never changes, but it is only for this user, so
+        # browsers may keep it indefinitely and shared caches not at all
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = REPORT_MAX_AGE
+        response.cache_control.immutable = True
         return response
         
     except Exception as e:
@@ -269,11 +555,82 @@ def download_report(review_id):
         flash('Error generating PDF report', 'error')
         return redirect(url_for('view_results', review_id=review_id))
 
+def poll_batches(user_id=None):
+    """Store results for queued reviews whose Batch API job has finished."""
+    pending = ComplianceReview.query.filter(
+        ComplianceReview.status == 'pending',
+        ComplianceReview.batch_id.isnot(None),
+    )
+    if user_id is not None:
+        pending = pending.filter_by(user_id=user_id)
+
+    reviews_by_batch = {}
+    for review in pending.all():
+        reviews_by_batch.setdefault(review.batch_id, []).append(review)
+
+    for batch_id, reviews in reviews_by_batch.items():
+        try:
+            batch_status, results = fetch_batch_results(batch_id)
+        except Exception as e:
+            logging.error(f"Error polling batch {batch_id}: {str(e)}")
+            continue
+        if results is None:
+            continue
+
+        for review in reviews:
+            result = results.get(str(review.id))
+            if result is None:
+                result = Exception(f"Batch {batch_status} without a result for this review")
+            if isinstance(result, Exception):
+                review.status = 'error'
+                review.error_message = str(result)
+            else:
+                _save_report(review, result)
+        db.session.commit()
+
+# History pages collect finished batches off the request thread, at most once
+# per BATCH_POLL_INTERVAL seconds per user; cron runs `flask poll-batches` for
+# everything else
+BATCH_POLL_INTERVAL = int(os.environ.get("BATCH_POLL_INTERVAL", "300"))
+_batch_poll_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-poll')
+_last_batch_poll = {}
+_batch_poll_lock = threading.Lock()
+
+def _poll_batches_job(user_id):
+    with app.app_context():
+        poll_batches(user_id=user_id)
+
+def _log_batch_poll_error(future):
+    if future.exception() is not None:
+        logging.error(f"Background batch poll error: {str(future.exception())}")
+
+def _queue_batch_poll(user_id):
+    """Poll the user's queued batches in the background unless done recently."""
+    now = time.monotonic()
+    with _batch_poll_lock:
+        last = _last_batch_poll.get(user_id)
+        if last is not None and now - last < BATCH_POLL_INTERVAL:
+            return
+        _last_batch_poll[user_id] = now
+    _batch_poll_executor.submit(_poll_batches_job, user_id).add_done_callback(_log_batch_poll_error)
+
+@app.cli.command('poll-batches')
+def poll_batches_command():
+    """Collect finished Batch API results (run periodically, e.g. from cron)."""
+    poll_batches()
+
 @app.route('/history')
 @require_login
 def view_history():
     """View past compliance reviews"""
-    reviews = ComplianceReview.query.filter_by(user_id=current_user.id).order_by(ComplianceReview.created_at.desc()).limit(20).all()
+    _queue_batch_poll(current_user.id)
+    # report_content and the embeddings stay deferred; error_message is shown
+    # for failed rows, so it loads here rather than one query per row
+    reviews = ComplianceReview.query.options(undefer(ComplianceReview.error_message)).filter_by(
+        user_id=current_user.id
+    ).order_by(ComplianceReview.created_at.desc()).limit(20).all()
+    for review in reviews:
+        _expire_stale_review(review)
     return render_template('history.html', reviews=reviews)
 
 @app.errorhandler(413)
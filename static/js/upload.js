@@ -164,6 +164,8 @@ document.addEventListener('DOMContentLoaded', function() {
         submitBtn.disabled = true;
         submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Processing...';
         
+        // The form posts normally: the review runs in the background and the
+        // server redirects to a page that follows its progress
         return true;
         });
     }